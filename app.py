@@ -1,33 +1,50 @@
 import os
-import glob
-import pandas as pd
-import numpy as np
 from flask import Flask, request, jsonify, render_template_string
 from flask_cors import CORS
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-from xgboost import XGBRegressor
 import warnings
-import shap
-import matplotlib
-matplotlib.use('Agg') # 使用非GUI后端，防止在服务器上出错
-import matplotlib.pyplot as plt
-import io
+import shutil
+import tempfile
 import base64
 import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from flask import Response, stream_with_context, g
+
+# 进程开始导入本模块的时间，用于统计应用自身的导入耗时
+APP_IMPORT_START = time.perf_counter()
+
+# pandas、xgboost、scikit-learn、shap、matplotlib 等重型库不在此处导入：
+# 首页和 /feedback 不需要它们，由后台预热线程（或首次使用时）再加载，缩短冷启动时间
+from artifacts import MODEL_DIR, has_latest_artifact, load_latest_artifact, save_artifact, training_lock
+from background import ProcessThread
+from batching import PREDICT_BATCHING_ENABLED, MicroBatcher
+from drift import DRIFT_ENABLED, DRIFT_RETRAIN_ENABLED, DriftMonitor
+from feedback_store import FEEDBACK_DB_PATH, FEEDBACK_FEATURE_COLS, FEEDBACK_FILE_PATH, FeedbackStore, import_csv
+from metrics import (
+    REQUEST_SECONDS, MetricsAggregator, SlowRequestProfiler, register_counters, render_gauge, render_gauges,
+    render_prometheus, timer,
+)
+from neighbors import NEIGHBORS_MAX_K, NeighborIndexUpdater
+from prediction_cache import PREDICT_CACHE_ENABLED, PredictionCache
+from retraining import RETRAIN_ENABLED, RetrainScheduler
+from sweep import build_grid, parse_sweep
 
 # --- 全局设置 ---
 warnings.filterwarnings('ignore')
-try:
-    plt.rcParams['font.sans-serif'] = ['SimHei']
-    plt.rcParams['axes.unicode_minus'] = False
-except Exception as e:
-    print(f"无法设置中文字体，图像中的中文可能无法显示: {e}")
 
-# --- 文件路径定义 ---
-# 在容器内部，我们将反馈数据存储在/app/feedback_storage/目录下
-FEEDBACK_FILE_PATH = '/app/feedback_storage/feedback_data.csv'
+# --- 批量预测设置 ---
+# 每个分块的行数：分块内一次性完成预处理、预测和SHAP计算，分块之间逐块输出，内存占用保持有界
+BATCH_CHUNK_ROWS = int(os.environ.get('BATCH_CHUNK_ROWS', 1000))
+# JSON数组请求体需要整体解析，因此限制其大小；更大的批次请上传CSV或NDJSON（每行一个JSON对象），二者都逐块读取
+BATCH_JSON_MAX_BYTES = int(os.environ.get('BATCH_JSON_MAX_BYTES', 10 * 1024 * 1024))
+BATCH_NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl')
+
+# --- 冷启动设置 ---
+# auto: 已有模型产物时同eager；首次部署尚无产物时同background，训练在后台进行，不阻塞主进程启动（默认）
+# background: 导入后立即开始服务首页和反馈，由各worker的后台预热线程加载重型库和模型
+# eager: 导入时同步加载完毕；配合gunicorn --preload，各worker通过fork以写时复制方式共享同一份模型内存
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'auto')
 
 # --- 前端HTML代码 (新增了反馈模块) ---
 HTML_TEMPLATE = """
@@ -279,19 +296,16 @@ HTML_TEMPLATE = """
         function loadSummaryPlot() {
             const contentDiv = document.getElementById('summary-plot-content');
             contentDiv.innerHTML = `<div class="flex justify-center items-center"><div class="loader"></div></div>`;
-            fetch(`${apiUrl}/shap_summary_plot`)
-            .then(response => response.ok ? response.json() : response.json().then(err => { throw new Error(err.error) }))
-            .then(result => {
-                if(result.image) {
-                    contentDiv.innerHTML = `<img src="data:image/png;base64,${result.image}" alt="全局特征重要性图" class="w-full h-auto"/>`;
-                } else {
-                    contentDiv.innerText = '无法加载图像。';
-                }
-            })
-            .catch(error => {
-                console.error('加载摘要图失败:', error);
-                contentDiv.innerHTML = `<p class="text-red-500">加载图像失败: ${error.message}</p>`;
-            });
+            // 直接加载PNG：服务器按模型版本返回ETag，浏览器再次加载时只需重新验证
+            const img = new Image();
+            img.alt = '全局特征重要性图';
+            img.className = 'w-full h-auto';
+            img.onload = () => { contentDiv.innerHTML = ''; contentDiv.appendChild(img); };
+            img.onerror = () => {
+                console.error('加载摘要图失败');
+                contentDiv.innerHTML = `<p class="text-red-500">加载图像失败。</p>`;
+            };
+            img.src = `${apiUrl}/shap_summary_plot.png`;
         }
 
         function displayError(message) {
@@ -307,190 +321,614 @@ HTML_TEMPLATE = """
 </html>
 """
 
-# --- 数据处理与模型训练逻辑 (已更新) ---
-def parse_cost_data(df):
-    costs = {}
-    df['金额'] = df['金额'].astype(str).str.replace(',', '').astype(float)
-    cost_mapping = {
-        'total_cost': '公路基本造价', 'build_install_cost': '建筑安装工程费',
-        'subgrade_cost': '路基工程', 'pavement_cost': '路面工程',
-        'bridge_culvert_cost': '桥梁涵洞工程', 'traffic_eng_cost': '交通工程及沿线设施',
-        'special_subgrade_cost': '特殊路基处理', 'land_acquisition_cost': '土地使用及拆迁补偿费'
-    }
-    for key, term in cost_mapping.items():
-        row = df[df['项目名称'].str.contains(term, na=False)]
-        costs[key] = row['金额'].iloc[0] if not row.empty else 0
-    if costs['total_cost'] == 0:
-        row = df[df['项目名称'].str.contains('第一至四部分合计', na=False)]
-        if not row.empty: costs['total_cost'] = row['金额'].iloc[0]
-    return costs
-
-def process_single_file(filepath):
-    try:
-        df = pd.read_csv(filepath, encoding='utf-8')
-    except:
-        df = pd.read_csv(filepath, encoding='gbk')
-    length_row = df[df['项目名称'].str.contains('公路公里', na=False)]
-    route_length_km = float(length_row['数量'].iloc[0]) if not length_row.empty else 1.0
-    costs = parse_cost_data(df)
-    build_install_cost = costs['build_install_cost'] if costs['build_install_cost'] > 0 else 1
-    total_cost = costs['total_cost'] if costs['total_cost'] > 0 else 1
-    subgrade_cost_total = costs['subgrade_cost'] if costs['subgrade_cost'] > 0 else 1
-    features = {
-        'route_length_km': route_length_km,
-        'subgrade_cost_ratio': costs['subgrade_cost'] / build_install_cost,
-        'pavement_cost_ratio': costs['pavement_cost'] / build_install_cost,
-        'bridge_culvert_cost_ratio': costs['bridge_culvert_cost'] / build_install_cost,
-        'traffic_eng_cost_ratio': costs['traffic_eng_cost'] / build_install_cost,
-        'special_subgrade_ratio': costs['special_subgrade_cost'] / subgrade_cost_total,
-        'land_acquisition_ratio': costs['land_acquisition_cost'] / total_cost,
-        'total_cost_cny': costs['total_cost']
-    }
-    if '一级' in filepath or '高速' in filepath: features['highway_grade'] = '一级'
-    elif '三级' in filepath: features['highway_grade'] = '三级'
-    else: features['highway_grade'] = '二级'
-    features['project_type'] = '新建' if '新建' in filepath else '改扩建'
-    pavement_area = features['route_length_km'] * 1000 * 20 
-    pavement_area = pavement_area if pavement_area > 0 else 1
-    actual_pavement_unit_cost = costs['pavement_cost'] / pavement_area
-    standard_pavement_unit_cost = 700 
-    features['pavement_cost_index'] = actual_pavement_unit_cost / standard_pavement_unit_cost
-    return features
-
-def load_and_process_all_data(data_path='data', feedback_path=FEEDBACK_FILE_PATH):
-    """加载初始数据和所有反馈数据"""
-    # 加载初始数据
-    initial_files = glob.glob(os.path.join(data_path, '*.csv'))
-    if not initial_files:
-        raise FileNotFoundError(f"在 '{data_path}' 目录下未找到任何初始CSV数据文件。")
-    
-    initial_features = [process_single_file(f) for f in initial_files]
-    df_initial = pd.DataFrame(initial_features)
-    
-    # 加载反馈数据
-    if os.path.exists(feedback_path):
-        print(f"发现反馈数据文件: {feedback_path}")
-        df_feedback = pd.read_csv(feedback_path)
-        # 合并新旧数据
-        df_combined = pd.concat([df_initial, df_feedback], ignore_index=True)
-        print(f"数据合并完成。初始数据: {len(df_initial)}条, 反馈数据: {len(df_feedback)}条, 总计: {len(df_combined)}条。")
-        return df_combined
-    else:
-        print("未发现反馈数据文件，仅使用初始数据进行训练。")
-        return df_initial
-
-def train_model(df):
-    X = df.drop('total_cost_cny', axis=1)
-    y = df['total_cost_cny']
-    categorical_features = ['highway_grade', 'project_type']
-    numeric_features = X.select_dtypes(include=np.number).columns.tolist()
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ('num', StandardScaler(), numeric_features),
-            ('cat', OneHotEncoder(handle_unknown='ignore'), categorical_features)
-        ], remainder='passthrough')
-    model_pipeline = Pipeline(steps=[
-        ('preprocessor', preprocessor),
-        ('regressor', XGBRegressor(objective='reg:squarederror', n_estimators=100, random_state=42))
-    ])
-    model_pipeline.fit(X, y)
-    try:
-        ohe_feature_names = model_pipeline.named_steps['preprocessor'].named_transformers_['cat'].get_feature_names_out(categorical_features)
-        all_feature_names = numeric_features + ohe_feature_names.tolist()
-    except: # 兼容旧版sklearn
-        ohe_feature_names = model_pipeline.named_steps['preprocessor'].named_transformers_['cat'].get_feature_names(categorical_features)
-        all_feature_names = numeric_features + list(ohe_feature_names)
-        
-    print("模型训练完成。")
-    return model_pipeline, X.columns.tolist(), all_feature_names
-
 # --- Flask应用设置 ---
 app = Flask(__name__)
 CORS(app)
 
-# --- 应用启动时，加载数据、训练模型、创建SHAP解释器 ---
-model_pipeline = None
-explainer = None
-TRAINING_COLS = []
-ALL_FEATURE_NAMES = []
-shap_values_global = None
+# --- 模型加载与预热 ---
+# 模型由离线命令 `python training.py` 训练并保存；这里只加载最新产物。
+# current_model 是一个不可变快照（模型、解释器、特征列、全局SHAP值、版本号），
+# 后台重新训练完成后整体替换这一个引用；每个请求开始时取一次快照，因此不会看到更新到一半的模型。
+current_model = None
+# 各启动阶段耗时（秒），由 /ready 返回
+startup_phases = {}
+warmup_error = None
+
+@contextmanager
+def startup_phase(name):
+    """记录一个启动阶段的耗时，同时写入 startup 阶段直方图"""
+    start = time.perf_counter()
+    with timer('startup', name):
+        yield
+    startup_phases[name] = round(time.perf_counter() - start, 4)
+
+def swap_model(artifact):
+    """在请求路径之外构建好解释器，然后用一次赋值原子地替换当前模型"""
+    global current_model
+    from drift import build_reference
+    from explain import build_explainer
+    from feature_encoder import FeatureEncoder
+    from neighbors import NeighborIndex
+
+    model_pipeline = artifact['model_pipeline']
+    # 旧版产物中没有编译好的编码器时，在此从已拟合的preprocessor现场编译
+    feature_encoder = artifact.get('feature_encoder') or FeatureEncoder.from_pipeline(model_pipeline, artifact['training_cols'])
+    current_model = {
+        'artifact': artifact,
+        'version': artifact['version'],
+        'model_pipeline': model_pipeline,
+        'explainer': build_explainer(model_pipeline, artifact['background']),
+        'training_cols': artifact['training_cols'],
+        'all_feature_names': artifact['all_feature_names'],
+        'shap_values_global': artifact['shap_values_global'],
+        'booster': model_pipeline.named_steps['regressor'].get_booster(),
+        'feature_encoder': feature_encoder,
+        # 每个模型版本一个相似项目索引；旧版产物中没有训练数据时为None
+        'neighbors': NeighborIndex(artifact, feature_encoder) if 'training_data' in artifact else None,
+        # 输入漂移监控的参考分布，同样需要产物中的训练数据
+        'drift_reference': build_reference(artifact['training_data'], artifact['training_cols']) if 'training_data' in artifact else None,
+    }
+    print(f"模型已切换到版本: {artifact['version']}")
+
+def get_model():
+    """取当前模型快照，并记录其版本号用于响应头"""
+    model = current_model
+    g.model_version = model['version'] if model is not None else None
+    return model
 
+def warm_up():
+    """加载重型库和最新模型产物；首次部署尚无产物时在本进程训练一次并保存"""
+    global warmup_error
+    try:
+        # 依次加载pandas、xgboost/shap、scikit-learn、matplotlib（含中文字体设置）
+        with startup_phase('import_libraries'):
+            import pandas  # noqa: F401
+            import explain  # noqa: F401
+            import feature_encoder  # noqa: F401
+            import summary_plot  # noqa: F401
+        print(f"正在从 '{MODEL_DIR}' 加载模型产物...")
+        with startup_phase('load_artifact'):
+            artifact = load_latest_artifact(MODEL_DIR)
+        if artifact is None:
+            # 首次部署尚无产物时训练一次并保存，之后的启动直接加载。各worker同时预热，
+            # 只有拿到训练锁的进程训练，其余进程等锁释放后重新检查LATEST，直接加载它写出的产物
+            with training_lock(MODEL_DIR):
+                artifact = load_latest_artifact(MODEL_DIR)
+                if artifact is None:
+                    print("未发现模型产物，正在加载数据并训练模型...")
+                    from ingestion import FEEDBACK_ROWS_ATTR, load_and_process_all_data
+                    from training import build_artifact
+                    with startup_phase('load_data'):
+                        processed_df = load_and_process_all_data()
+                    with startup_phase('build_artifact'):
+                        artifact = build_artifact(processed_df, processed_df.attrs[FEEDBACK_ROWS_ATTR])
+                    save_artifact(artifact, MODEL_DIR)
+        with startup_phase('swap_model'):
+            swap_model(artifact)
+        warmup_error = None
+        print(f"系统准备就绪，启动阶段耗时: {startup_phases}")
+    except Exception as e:
+        warmup_error = str(e)
+        print(f"初始化失败: {e}")
+
+warmup_thread = ProcessThread(warm_up, 'model-warmup')
+
+def start_warmup():
+    """在当前进程中启动一次后台预热线程。gunicorn.conf.py 的 post_fork
+    钩子在每个worker启动时调用，首个请求到达时也会再检查一次。"""
+    if current_model is not None:
+        # eager模式下主进程已加载完毕，worker直接共享
+        return
+    warmup_thread.start()
+
+def model_unavailable():
+    """模型尚未就绪时的统一响应：加载中返回503（可重试），加载失败返回500"""
+    if warmup_error is not None:
+        return jsonify({'error': f'模型加载失败: {warmup_error}'}), 500
+    response = jsonify({'error': '模型正在加载，请稍后重试。'})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+neighbor_updater = NeighborIndexUpdater(
+    get_index=lambda: current_model['neighbors'] if current_model is not None else None,
+)
+
+retrain_scheduler = RetrainScheduler(
+    get_artifact=lambda: current_model['artifact'] if current_model is not None else None,
+    on_new_artifact=swap_model,
+)
+
+# 统计 /predict 的输入分布并与训练数据比较；可选在判定漂移时请求后台重新训练
+drift_monitor = DriftMonitor(
+    on_drift=(lambda report: retrain_scheduler.request_retrain(f"输入漂移，最大PSI {report['max_psi']:.3f}"))
+    if DRIFT_RETRAIN_ENABLED else None
+) if DRIFT_ENABLED else None
+
+# --- 反馈存储：单写入线程批量提交到SQLite（WAL模式） ---
+feedback_store = None
 try:
-    print("正在加载数据并训练模型...")
-    # 确保feedback目录存在
-    os.makedirs(os.path.dirname(FEEDBACK_FILE_PATH), exist_ok=True)
-    
-    processed_df = load_and_process_all_data()
-    model_pipeline, TRAINING_COLS, ALL_FEATURE_NAMES = train_model(processed_df)
-    X_train_processed = pd.DataFrame(
-        model_pipeline.named_steps['preprocessor'].transform(processed_df.drop('total_cost_cny', axis=1)),
-        columns=ALL_FEATURE_NAMES
-    )
-    explainer = shap.Explainer(model_pipeline.named_steps['regressor'], X_train_processed)
-    shap_values_global = explainer(X_train_processed)
-    print("系统准备就绪。")
+    feedback_store = FeedbackStore(FEEDBACK_DB_PATH)
+    # 一次性迁移旧版CSV反馈文件，迁移后CSV被改名，不会重复导入
+    if os.path.exists(FEEDBACK_FILE_PATH):
+        import_csv(FEEDBACK_FILE_PATH, FEEDBACK_DB_PATH)
 except Exception as e:
-    print(f"初始化失败: {e}")
+    print(f"反馈存储初始化失败: {e}")
+
+# 重复的“what-if”查询直接返回缓存结果；缓存键包含模型版本，模型切换后旧结果自动失效
+prediction_cache = PredictionCache() if PREDICT_CACHE_ENABLED else None
+if prediction_cache is not None:
+    register_counters(prediction_cache.counter_samples)
+
+# 直方图和计数器按worker写入共享目录，/metrics 输出所有worker合并后的结果
+metrics_aggregator = MetricsAggregator()
+
+# 慢请求采样分析，默认关闭，可在运行时通过 /metrics/profiling 开启
+profiler = SlowRequestProfiler()
+
+@app.before_request
+def start_background_threads():
+    start_warmup()
+    metrics_aggregator.ensure_started()
+    # 模型就绪后再启动重新训练线程，避免与预热线程重复加载产物
+    if RETRAIN_ENABLED and current_model is not None:
+        retrain_scheduler.ensure_started()
+    if current_model is not None:
+        neighbor_updater.ensure_started()
+        if drift_monitor is not None:
+            drift_monitor.ensure_started()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profile = profiler.start()
+
+@app.after_request
+def add_model_version_header(response):
+    g.response_status = response.status_code
+    version = g.get('model_version')
+    if version is None and current_model is not None:
+        version = current_model['version']
+    if version is not None:
+        response.headers['X-Model-Version'] = version
+    return response
+
+@app.teardown_request
+def record_request_duration(exc):
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+    endpoint = request.endpoint or 'unknown'
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.stop(profile, endpoint, duration)
+    status = g.get('response_status', 500 if exc is not None else 200)
+    REQUEST_SECONDS.observe(duration, endpoint, request.method, str(status))
 
 # --- API端点 ---
 @app.route('/')
 def home():
     return render_template_string(HTML_TEMPLATE)
 
-@app.route('/feedback', methods=)
+@app.route('/healthz')
+def healthz():
+    """存活检查：进程已能响应请求（首页和反馈无需等待模型加载）"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/ready')
+def ready():
+    """就绪检查：模型加载完成后返回200，加载中返回503，加载失败返回500"""
+    model = current_model
+    body = {'ready': model is not None, 'startup_phases': startup_phases}
+    if model is not None:
+        body['model_version'] = model['version']
+        return jsonify(body)
+    body['error'] = warmup_error
+    return jsonify(body), 500 if warmup_error is not None else 503
+
+@app.route('/feedback', methods=['POST'])
 def handle_feedback():
     """接收并存储用户反馈的数据"""
     try:
-        data = request.get_json(force=True)
-        df_new = pd.DataFrame([data])
-        
-        # 将新数据追加到CSV文件中
-        # 如果文件不存在，则创建并写入表头；否则，追加并不写表头
-        df_new.to_csv(FEEDBACK_FILE_PATH, mode='a', header=not os.path.exists(FEEDBACK_FILE_PATH), index=False)
-        
-        return jsonify({'success': True, 'message': '反馈成功！新数据已保存，重启应用后模型将自动学习。'})
+        if feedback_store is None:
+            return jsonify({'success': False, 'error': '反馈存储未成功初始化。'}), 500
+        with timer('feedback', 'parse_json'):
+            data = request.get_json(force=True)
+        model = get_model()
+        training_cols = model['training_cols'] if model is not None else FEEDBACK_FEATURE_COLS
+        try:
+            with timer('feedback', 'store'):
+                inserted = feedback_store.submit(data, training_cols)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if inserted:
+            retrain_scheduler.notify_feedback()
+            neighbor_updater.notify_feedback()
+            message = '反馈成功！新数据已保存，模型将在后台自动学习并更新。'
+        else:
+            message = '该反馈此前已提交过，无需重复提交。'
+        return jsonify({
+            'success': True,
+            'duplicate': not inserted,
+            'message': message,
+            'model_version': model['version'] if model is not None else None
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def cacheable(response, model):
+    """全局图只随模型版本变化：以版本号作ETag、产物生成时间作Last-Modified，浏览器重新验证时直接返回304"""
+    response.set_etag(model['version'])
+    response.last_modified = datetime.fromisoformat(model['artifact']['created_at'])
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/shap_summary_plot')
 def get_shap_summary_plot():
-    if shap_values_global is None:
+    model = get_model()
+    if model is None:
+        return model_unavailable()
+    if model['shap_values_global'] is None:
         return jsonify({'error': 'SHAP值未计算，无法生成图像。'}), 500
     try:
-        fig, ax = plt.subplots(figsize=(10, 8))
-        shap.summary_plot(shap_values_global, plot_type="bar", show=False, feature_names=ALL_FEATURE_NAMES)
-        plt.title('全局特征重要性')
-        plt.tight_layout()
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', bbox_inches='tight')
-        plt.close(fig)
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        return jsonify({'image': img_str})
+        from summary_plot import get_summary_png
+
+        with timer('shap_summary_plot', 'render'):
+            png = get_summary_png(model['version'], model['shap_values_global'], model['all_feature_names'])
+        with timer('shap_summary_plot', 'serialize'):
+            img_str = base64.b64encode(png).decode('utf-8')
+            response = jsonify({'image': img_str, 'model_version': model['version']})
+        return cacheable(response, model)
+    except Exception as e:
+        return jsonify({'error': f'生成图像时出错: {str(e)}'}), 500
+
+@app.route('/shap_summary_plot.png')
+def get_shap_summary_plot_png():
+    model = get_model()
+    if model is None:
+        return model_unavailable()
+    if model['shap_values_global'] is None:
+        return jsonify({'error': 'SHAP值未计算，无法生成图像。'}), 500
+    try:
+        from summary_plot import get_summary_png
+
+        with timer('shap_summary_plot', 'render'):
+            png = get_summary_png(model['version'], model['shap_values_global'], model['all_feature_names'])
+        return cacheable(Response(png, mimetype='image/png'), model)
     except Exception as e:
         return jsonify({'error': f'生成图像时出错: {str(e)}'}), 500
 
-@app.route('/predict', methods=)
+@app.route('/shap_summary')
+def get_shap_summary():
+    """返回各特征的平均|SHAP|，前端可自行绘制全局特征重要性图"""
+    model = get_model()
+    if model is None:
+        return model_unavailable()
+    if model['shap_values_global'] is None:
+        return jsonify({'error': 'SHAP值未计算。'}), 500
+    from summary_plot import get_feature_importance
+
+    importance = get_feature_importance(model['version'], model['shap_values_global'], model['all_feature_names'])
+    return cacheable(jsonify({'feature_importance': importance, 'model_version': model['version']}), model)
+
+def score_frame(model, input_df):
+    """对一批输入行只做一次预处理，并一次性完成预测与SHAP计算"""
+    import pandas as pd
+
+    model_pipeline = model['model_pipeline']
+    input_processed = pd.DataFrame(
+        model_pipeline.named_steps['preprocessor'].transform(input_df),
+        columns=model['all_feature_names']
+    )
+    prediction = model_pipeline.named_steps['regressor'].predict(input_processed.to_numpy())
+    shap_values = model['explainer'](input_processed)
+    return prediction, input_processed, shap_values
+
+def predict_single(model, data):
+    """单行快速路径：编译编码器直接把请求字典写入预分配向量，跳过DataFrame和ColumnTransformer"""
+    with timer('predict', 'encode'):
+        feature_row, model_input = model['feature_encoder'].encode(data)
+    with timer('predict', 'predict'):
+        prediction = model['booster'].inplace_predict(model_input)
+    with timer('predict', 'explain'):
+        shap_values_single = model['explainer'](model_input)
+    return {
+        'estimated_cost': prediction.tolist(),
+        'shap_values': shap_values_single.values[0].tolist(),
+        'base_value': float(shap_values_single.base_values[0]),
+        'feature_names': model['all_feature_names'],
+        'feature_values': feature_row.tolist(),
+        'model_version': model['version']
+    }
+
+def score_encoded_rows(model, feature_rows):
+    """对多行已编码的特征一次完成预测与解释，返回与 predict_single 相同结构的逐行结果"""
+    import numpy as np
+
+    model_input = feature_rows.astype(np.float32)
+    with timer('predict', 'batch_predict'):
+        prediction = model['booster'].inplace_predict(model_input)
+    with timer('predict', 'batch_explain'):
+        shap_values = model['explainer'](model_input)
+    return [{
+        'estimated_cost': prediction[i:i + 1].tolist(),
+        'shap_values': shap_values.values[i].tolist(),
+        'base_value': float(shap_values.base_values[i]),
+        'feature_names': model['all_feature_names'],
+        'feature_values': feature_rows[i].tolist(),
+        'model_version': model['version']
+    } for i in range(len(feature_rows))]
+
+# 并发的单行预测合并为一批计算（默认关闭）；编码在请求线程中完成，调度线程只负责预测和解释
+predict_batcher = MicroBatcher(score_encoded_rows) if PREDICT_BATCHING_ENABLED else None
+if predict_batcher is not None:
+    register_counters(predict_batcher.counter_samples)
+
+def predict_batched(model, data):
+    with timer('predict', 'encode'):
+        feature_row, _ = model['feature_encoder'].encode(data)
+        # 编码结果是本线程的缓冲区，交给调度线程前需要拷贝
+        feature_row = feature_row.copy()
+    with timer('predict', 'batch_wait'):
+        return predict_batcher.submit(model, feature_row)
+
+@app.route('/predict', methods=['POST'])
 def predict():
-    if model_pipeline is None or explainer is None:
-        return jsonify({'error': '模型或解释器未成功加载。'}), 500
+    """单行预测，返回估算造价及各特征的SHAP贡献值（sum(shap_values) + base_value = estimated_cost）。
+
+    SHAP值的含义取决于 SHAP_MODE：默认的tree模式为路径依赖TreeSHAP，base_value是训练样本的平均预测值；
+    background模式为旧版按背景数据干预的SHAP，base_value是背景数据的平均预测值。两种模式的逐特征贡献值不完全相同。
+    """
+    model = get_model()
+    if model is None:
+        return model_unavailable()
+    # 可选：/predict?neighbors=k 同时返回k个最相似的历史项目及其真实造价
     try:
-        data = request.get_json(force=True)
-        input_df = pd.DataFrame([data], columns=TRAINING_COLS)
-        input_processed = pd.DataFrame(
-            model_pipeline.named_steps['preprocessor'].transform(input_df),
-            columns=ALL_FEATURE_NAMES
-        )
-        prediction = model_pipeline.predict(input_df)
-        shap_values_single = explainer(input_processed)
-        return jsonify({
-            'estimated_cost': prediction.tolist(),
-            'shap_values': shap_values_single.values[0].tolist(),
-            'base_value': shap_values_single.base_values[0],
-            'feature_names': ALL_FEATURE_NAMES,
-            'feature_values': input_processed.iloc[0].tolist()
-        })
+        n_neighbors = int(request.args.get('neighbors', 0))
+    except ValueError:
+        n_neighbors = -1
+    if not 0 <= n_neighbors <= NEIGHBORS_MAX_K:
+        return jsonify({'error': f'neighbors必须是0到{NEIGHBORS_MAX_K}之间的整数。'}), 400
+    if n_neighbors and model['neighbors'] is None:
+        return jsonify({'error': '当前模型产物不包含历史项目数据，请重新训练后再查询相似项目。'}), 400
+    try:
+        with timer('predict', 'parse_json'):
+            data = request.get_json(force=True)
+        score = predict_single if predict_batcher is None else predict_batched
+        if prediction_cache is None:
+            result = score(model, data)
+        else:
+            with timer('predict', 'cache_lookup'):
+                cache_key = prediction_cache.make_key(model['version'], model['training_cols'], data)
+                result = prediction_cache.get(model['version'], cache_key)
+            if result is None:
+                result = score(model, data)
+                prediction_cache.put(model['version'], cache_key, result)
+        if drift_monitor is not None and model['drift_reference'] is not None:
+            with timer('predict', 'drift'):
+                drift_monitor.observe(model['version'], model['drift_reference'], data)
+        if n_neighbors:
+            with timer('predict', 'neighbors'):
+                # 缓存中的结果可能被其他请求共享，不在原字典上修改；相似项目检索失败时仍返回预测结果
+                try:
+                    feature_row, _ = model['feature_encoder'].encode(data)
+                    result = {**result, 'neighbors': model['neighbors'].query(feature_row, n_neighbors)}
+                except Exception as e:
+                    print(f"相似项目检索失败: {e}")
+                    result = {**result, 'neighbors_error': f'相似项目检索失败: {str(e)}'}
+        with timer('predict', 'serialize'):
+            return jsonify(result)
     except Exception as e:
         return jsonify({'error': f'预测时发生错误: {str(e)}'}), 400
 
+@app.route('/predict_sweep', methods=['POST'])
+def predict_sweep():
+    """敏感性分析：基准项目 + 一到两个特征的取值范围，整个网格一次编码、一次预测，返回一维曲线或二维曲面。
+
+    请求体: {"base": {...}, "sweep": [{"feature": "pavement_cost_index", "start": 0.9, "stop": 1.3, "num": 41}], "shap": false}
+    """
+    import numpy as np
+
+    model = get_model()
+    if model is None:
+        return model_unavailable()
+    encoder = model['feature_encoder']
+    try:
+        with timer('predict_sweep', 'parse_json'):
+            data = request.get_json(force=True)
+            base, axes = parse_sweep(data, model['training_cols'], [column for column, _ in encoder.categorical])
+        with timer('predict_sweep', 'encode'):
+            grid, shape = build_grid(encoder, base, axes)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'扫描参数无效: {str(e)}'}), 400
+    try:
+        model_input = grid.astype(np.float32)
+        with timer('predict_sweep', 'predict'):
+            prediction = model['booster'].inplace_predict(model_input)
+        result = {
+            'features': [feature for feature, _ in axes],
+            'values': [values for _, values in axes],
+            'estimated_cost': prediction.reshape(shape).tolist(),
+            'model_version': model['version']
+        }
+        if data.get('shap'):
+            with timer('predict_sweep', 'explain'):
+                shap_values = model['explainer'](model_input)
+            result['shap_values'] = shap_values.values.reshape(shape + [-1]).tolist()
+            result['base_value'] = float(shap_values.base_values[0])
+            result['feature_names'] = model['all_feature_names']
+        with timer('predict_sweep', 'serialize'):
+            return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': f'预测时发生错误: {str(e)}'}), 500
+
+@app.route('/drift')
+def get_drift():
+    """合并所有worker的统计，返回当前模型版本下各输入特征相对训练数据的PSI漂移分数"""
+    model = get_model()
+    if model is None:
+        return model_unavailable()
+    if drift_monitor is None:
+        return jsonify({'enabled': False})
+    if model['drift_reference'] is None:
+        return jsonify({'error': '当前模型产物不包含训练数据，无法计算漂移。'}), 400
+    return jsonify({'enabled': True, **drift_monitor.report(model['version'], model['drift_reference'])})
+
+@app.route('/predict_cache/stats')
+def get_prediction_cache_stats():
+    if prediction_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **prediction_cache.stats()})
+
+@app.route('/predict_batching/stats')
+def get_predict_batching_stats():
+    if predict_batcher is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **predict_batcher.stats()})
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus文本格式的指标：各阶段耗时直方图、模型版本、训练数据量、待学习的反馈条数。
+
+    直方图和计数器为所有worker之和；模型状态类指标取自处理本次抓取的worker。
+    """
+    model = current_model
+    merged = metrics_aggregator.collect()
+    sections = [render_gauge('estimator_metrics_workers', '参与汇总的worker快照数（含已退出的worker）', merged['workers']),
+                render_gauge('estimator_model_ready', '模型是否已加载完成（1为就绪）', int(model is not None))]
+    if startup_phases:
+        sections.append(render_gauges(
+            'estimator_startup_phase_seconds', '各启动阶段耗时（秒）',
+            [([('phase', phase)], seconds) for phase, seconds in startup_phases.items()]
+        ))
+    if model is not None:
+        artifact = model['artifact']
+        sections.append(render_gauge('estimator_model_info', '当前加载的模型版本', 1, [('version', model['version'])]))
+        sections.append(render_gauge('estimator_training_rows', '当前模型的训练数据条数', artifact['n_rows']))
+        if feedback_store is not None:
+            backlog = feedback_store.count() - artifact.get('n_feedback_rows', 0)
+            sections.append(render_gauge('estimator_feedback_backlog', '尚未被当前模型学习的反馈条数', max(backlog, 0)))
+    # 漂移分数取后台线程最近一次合并计算的结果，抓取指标时不读取快照文件
+    drift = drift_monitor.last_report if drift_monitor is not None else None
+    if drift is not None:
+        sections.append(render_gauge('estimator_drift_samples', '当前模型版本下参与漂移统计的请求数（所有worker合计）', drift['samples']))
+        sections.append(render_gauges(
+            'estimator_drift_psi', '各输入特征相对训练数据的PSI',
+            [([('feature', feature)], f['psi']) for feature, f in drift['features'].items()]
+        ))
+    return Response(render_prometheus(sections, merged), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/profiling', methods=['GET', 'POST'])
+def configure_profiling():
+    """查看或修改慢请求采样分析：POST {"enabled": true, "sample_rate": 0.05, "slow_ms": 100}"""
+    if request.method == 'POST':
+        try:
+            options = request.get_json(force=True) or {}
+            profiler.configure(options.get('enabled'), options.get('sample_rate'), options.get('slow_ms'))
+        except (TypeError, ValueError, AttributeError) as e:
+            return jsonify({'error': f'参数无效: {str(e)}'}), 400
+    return jsonify(profiler.status())
+
+def iter_batch_chunks(training_cols):
+    """将请求体（JSON数组、NDJSON或上传的CSV）拆分为按TRAINING_COLS排列的DataFrame分块"""
+    import pandas as pd
+
+    upload = request.files.get('file')
+    if upload is not None or request.mimetype == 'text/csv' or request.mimetype in BATCH_NDJSON_MIMETYPES:
+        # 上传文件会在视图返回后随请求一起关闭，因此转存到由生成器自己持有的临时文件中
+        stream = tempfile.TemporaryFile()
+        shutil.copyfileobj(upload.stream if upload is not None else request.stream, stream)
+        stream.seek(0)
+        if request.mimetype in BATCH_NDJSON_MIMETYPES:
+            yield from iter_ndjson_chunks(stream, training_cols)
+            return
+        for chunk in pd.read_csv(stream, chunksize=BATCH_CHUNK_ROWS):
+            missing = [c for c in training_cols if c not in chunk.columns]
+            if missing:
+                raise ValueError(f'CSV缺少必要的列: {missing}')
+            yield chunk[training_cols]
+        return
+    # 多读一个字节即可判断是否超限，超限的请求体不会被整体读入内存
+    body = request.stream.read(BATCH_JSON_MAX_BYTES + 1)
+    if len(body) > BATCH_JSON_MAX_BYTES:
+        raise ValueError(f'JSON请求体超过{BATCH_JSON_MAX_BYTES}字节，大批量请以CSV或NDJSON（application/x-ndjson）上传。')
+    data = json.loads(body)
+    if not isinstance(data, list):
+        raise ValueError('请求体必须是JSON数组、NDJSON或CSV文件。')
+    for start in range(0, len(data), BATCH_CHUNK_ROWS):
+        yield pd.DataFrame(data[start:start + BATCH_CHUNK_ROWS], columns=training_cols)
+
+def iter_ndjson_chunks(stream, training_cols):
+    """逐行读取NDJSON（每行一个JSON对象，空行忽略），每攒满BATCH_CHUNK_ROWS行输出一个分块"""
+    import pandas as pd
+
+    rows = []
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError(f'NDJSON第{line_number}行必须是JSON对象。')
+        rows.append(row)
+        if len(rows) == BATCH_CHUNK_ROWS:
+            yield pd.DataFrame(rows, columns=training_cols)
+            rows = []
+    if rows:
+        yield pd.DataFrame(rows, columns=training_cols)
+
+def chunk_to_ndjson(prediction, shap_values, row_offset, model_version):
+    lines = []
+    for i in range(len(prediction)):
+        lines.append(json.dumps({
+            'row': row_offset + i,
+            'estimated_cost': float(prediction[i]),
+            'base_value': float(shap_values.base_values[i]),
+            'shap_values': shap_values.values[i].tolist(),
+            'model_version': model_version
+        }, ensure_ascii=False))
+    return '\n'.join(lines) + '\n'
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """批量预测：逐块返回NDJSON，每行包含造价、基准值和SHAP向量。
+
+    输入可以是JSON数组（不超过BATCH_JSON_MAX_BYTES）、NDJSON（Content-Type: application/x-ndjson）或CSV。
+    """
+    # 整个流式响应都使用同一个模型快照，中途切换模型不会影响已开始的批次
+    model = get_model()
+    if model is None:
+        return model_unavailable()
+    try:
+        chunks = iter_batch_chunks(model['training_cols'])
+        # 先读取第一块，使格式错误能以400返回，而不是在流式输出中途失败
+        first_chunk = next(chunks, None)
+    except Exception as e:
+        return jsonify({'error': f'批量预测输入无效: {str(e)}'}), 400
+    if first_chunk is None:
+        return jsonify({'error': '批量预测输入为空。'}), 400
+
+    def generate():
+        row_offset = 0
+        chunk = first_chunk
+        while chunk is not None:
+            try:
+                prediction, _, shap_values = score_frame(model, chunk)
+                yield chunk_to_ndjson(prediction, shap_values, row_offset, model['version'])
+            except Exception as e:
+                yield json.dumps({'row': row_offset, 'rows': len(chunk), 'error': f'预测时发生错误: {str(e)}'}, ensure_ascii=False) + '\n'
+            row_offset += len(chunk)
+            try:
+                chunk = next(chunks, None)
+            except Exception as e:
+                yield json.dumps({'row': row_offset, 'error': f'批量预测输入无效: {str(e)}'}, ensure_ascii=False) + '\n'
+                chunk = None
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# 应用自身（不含重型库）的导入耗时
+startup_phases['import_app'] = round(time.perf_counter() - APP_IMPORT_START, 4)
+if MODEL_WARMUP == 'eager' or (MODEL_WARMUP == 'auto' and has_latest_artifact(MODEL_DIR)):
+    warm_up()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
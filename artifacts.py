@@ -0,0 +1,64 @@
+import os
+import fcntl
+from contextlib import contextmanager
+
+# --- 模型产物设置 ---
+# 离线训练命令将训练结果写入带版本号的产物文件，服务进程只负责加载，不再在导入时重新训练。
+# 本模块只负责产物的读写，joblib 及反序列化所需的重型依赖都在读写时才导入，服务进程可以在后台线程中再加载模型。
+MODEL_DIR = os.environ.get('MODEL_DIR', 'models')
+LATEST_POINTER = 'LATEST'
+# 模型目录下的训练锁文件：同一时间只有一个进程训练并写入产物
+TRAINING_LOCK = '.retrain.lock'
+
+def save_artifact(artifact, model_dir=MODEL_DIR):
+    """原子地写入产物文件并更新LATEST指针，正在加载的进程不会读到写了一半的文件"""
+    import joblib
+
+    os.makedirs(model_dir, exist_ok=True)
+    filename = f"model-{artifact['version']}.joblib"
+    path = os.path.join(model_dir, filename)
+    # 临时文件名带进程号：同一秒内用相同数据训练的多个进程会得到相同的版本号
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(artifact, tmp_path)
+    os.replace(tmp_path, path)
+    pointer_path = os.path.join(model_dir, LATEST_POINTER)
+    with open(f"{pointer_path}.{os.getpid()}.tmp", 'w') as f:
+        f.write(filename)
+    os.replace(f"{pointer_path}.{os.getpid()}.tmp", pointer_path)
+    print(f"模型产物已保存: {path}")
+    return path
+
+@contextmanager
+def training_lock(model_dir=MODEL_DIR, blocking=True):
+    """持有模型目录下的训练文件锁；blocking=False 时拿不到锁立即返回，with语句得到False"""
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, TRAINING_LOCK), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+def latest_artifact_path(model_dir=MODEL_DIR):
+    pointer_path = os.path.join(model_dir, LATEST_POINTER)
+    if not os.path.exists(pointer_path):
+        return None
+    with open(pointer_path) as f:
+        return os.path.join(model_dir, f.read().strip())
+
+def has_latest_artifact(model_dir=MODEL_DIR):
+    path = latest_artifact_path(model_dir)
+    return path is not None and os.path.exists(path)
+
+def load_artifact(path):
+    import joblib
+
+    artifact = joblib.load(path)
+    print(f"已加载模型产物: {path} (版本 {artifact['version']}, 训练数据 {artifact['n_rows']}条)")
+    return artifact
+
+def load_latest_artifact(model_dir=MODEL_DIR):
+    if not has_latest_artifact(model_dir):
+        return None
+    return load_artifact(latest_artifact_path(model_dir))
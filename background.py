@@ -0,0 +1,31 @@
+import os
+import threading
+
+# --- 按进程启动的后台线程 ---
+# gunicorn --preload 时这些对象在主进程中创建，但线程不会随fork继承到worker，
+# 因此按进程号判断，在每个用到它的进程中各启动一次
+
+class ProcessThread:
+    """每个进程只启动一次的守护线程。
+
+    start() 可以在每次请求时调用，同一进程内只有第一次调用会启动线程；
+    before_start 在启动线程前（持锁）调用，用于重置从父进程复制来的状态，如队列、快照文件名。
+    """
+
+    def __init__(self, target, name, before_start=None):
+        self.target = target
+        self.name = name
+        self.before_start = before_start
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self.before_start is not None:
+                self.before_start()
+            threading.Thread(target=self.target, name=self.name, daemon=True).start()
+            self._pid = os.getpid()
@@ -0,0 +1,117 @@
+import os
+import time
+import queue
+import threading
+import numpy as np
+
+from background import ProcessThread
+from metrics import Histogram
+
+# --- 单行预测微批处理设置 ---
+# 开启后，并发到达的单行 /predict 请求在调度线程中合并为一批，一次完成预测和SHAP计算。
+# 需要worker内有多个请求线程（gunicorn --threads 或 gthread worker）才会有并发请求可合并。
+PREDICT_BATCHING_ENABLED = os.environ.get('PREDICT_BATCHING_ENABLED', '0') == '1'
+# 批次从收到第一条请求起最多等待这么久，或攒满这么多行就立即计算
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get('PREDICT_BATCH_WINDOW_MS', 2))
+PREDICT_BATCH_MAX_ROWS = int(os.environ.get('PREDICT_BATCH_MAX_ROWS', 32))
+# 请求等待其所在批次计算完成的最长时间
+PREDICT_BATCH_TIMEOUT_SECONDS = float(os.environ.get('PREDICT_BATCH_TIMEOUT_SECONDS', 10))
+
+BATCH_ROWS = Histogram(
+    'estimator_predict_batch_rows', '微批处理每批的行数', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+BATCH_FILL_RATIO = Histogram(
+    'estimator_predict_batch_fill_ratio', '微批处理每批行数占批次上限的比例', buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1.0)
+)
+
+class MicroBatcher:
+    """把并发的单行预测合并成批计算的调度器。
+
+    请求线程先在本线程内完成特征编码，再把编码后的向量放进队列并等待结果；调度线程在
+    window_ms窗口内（或攒满max_rows行时）取出一批，按模型快照分组后调用score_batch一次
+    完成预测和解释，再把每一行的结果交回对应的请求。编码错误只影响该请求本身。
+    """
+
+    def __init__(self, score_batch, window_ms=PREDICT_BATCH_WINDOW_MS, max_rows=PREDICT_BATCH_MAX_ROWS):
+        self.score_batch = score_batch
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self._queue = queue.Queue()
+        self._thread = ProcessThread(self._run, 'predict-batcher', before_start=self._new_queue)
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._rows = 0
+        self._full_flushes = 0
+
+    def _new_queue(self):
+        # 主进程队列中残留的条目属于已不存在的请求线程
+        self._queue = queue.Queue()
+
+    def submit(self, model, feature_row):
+        """提交一行已编码的特征（float64向量），阻塞到所在批次计算完成并返回该行的结果"""
+        self._thread.start()
+        item = {'model': model, 'row': feature_row, 'done': threading.Event(), 'result': None, 'error': None}
+        self._queue.put(item)
+        if not item['done'].wait(PREDICT_BATCH_TIMEOUT_SECONDS):
+            raise TimeoutError('批量预测调度超时。')
+        if item['error'] is not None:
+            raise item['error']
+        return item['result']
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._record(len(batch))
+            # 模型在窗口期间切换时，同一批内可能混有新旧两个快照，各自分组计算
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item['model']), []).append(item)
+            for items in groups.values():
+                try:
+                    results = self.score_batch(items[0]['model'], np.stack([item['row'] for item in items]))
+                    for item, result in zip(items, results):
+                        item['result'] = result
+                except Exception as e:
+                    for item in items:
+                        item['error'] = e
+            for item in batch:
+                item['done'].set()
+
+    def _record(self, n_rows):
+        BATCH_ROWS.observe(n_rows)
+        BATCH_FILL_RATIO.observe(n_rows / self.max_rows)
+        with self._stats_lock:
+            self._batches += 1
+            self._rows += n_rows
+            if n_rows >= self.max_rows:
+                self._full_flushes += 1
+
+    def stats(self):
+        with self._stats_lock:
+            batches, rows, full_flushes = self._batches, self._rows, self._full_flushes
+        return {
+            'window_ms': self.window * 1000,
+            'max_rows': self.max_rows,
+            'batches': batches,
+            'rows': rows,
+            'full_flushes': full_flushes,
+            'mean_batch_rows': rows / batches if batches else 0.0,
+            'mean_fill_ratio': rows / (batches * self.max_rows) if batches else 0.0,
+        }
+
+    def counter_samples(self):
+        """本进程的计数器样本，由 metrics.register_counters 登记后在 /metrics 中按所有worker求和"""
+        stats = self.stats()
+        return [
+            ('estimator_predict_batches_total', '微批处理已计算的批次数', [], stats['batches']),
+            ('estimator_predict_batch_full_flushes_total', '因攒满行数上限而提前计算的批次数', [], stats['full_flushes']),
+        ]
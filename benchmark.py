@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# --- 基准测试设置 ---
+BENCHMARK_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# 与基线相比变慢（或吞吐下降）超过该比例即视为性能回退
+BENCHMARK_TOLERANCE = 0.5
+# 绝对变化小于该值（秒）的耗时波动不计为回退，避免亚毫秒级指标的噪声
+BENCHMARK_MIN_ABS_DELTA_S = 0.005
+# 吞吐类指标越大越好，其余耗时类指标越小越好
+HIGHER_IS_BETTER = ('predict_throughput_rps',)
+
+HIGHWAY_GRADES = ['一级', '二级', '三级', '高速']
+PROJECT_TYPES = ['新建', '改扩建']
+
+# --- 合成数据生成 ---
+def synthetic_project(rng):
+    """随机生成一个项目的主要造价构成（元）"""
+    length = rng.uniform(3, 60)
+    subgrade = length * rng.uniform(2e6, 6e6)
+    pavement = length * rng.uniform(1e6, 4e6)
+    bridge = length * rng.uniform(0.5e6, 5e6)
+    traffic = length * rng.uniform(0.2e6, 1e6)
+    build_install = subgrade + pavement + bridge + traffic + length * rng.uniform(0.5e6, 2e6)
+    land = build_install * rng.uniform(0.05, 0.25)
+    return {
+        'highway_grade': rng.choice(HIGHWAY_GRADES), 'project_type': rng.choice(PROJECT_TYPES),
+        'length': length, 'subgrade': subgrade, 'pavement': pavement, 'bridge': bridge, 'traffic': traffic,
+        'special_subgrade': subgrade * rng.uniform(0.02, 0.2), 'build_install': build_install, 'land': land,
+        'total': build_install + land + build_install * rng.uniform(0.05, 0.15),
+    }
+
+def generate_estimate_csvs(out_dir, n_projects, seed=0):
+    """生成 process_single_file 所需格式（项目名称/数量/金额）的合成概算CSV，按真实数据混用utf-8与gbk编码"""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    for i in range(n_projects):
+        p = synthetic_project(rng)
+        rows = [
+            ('公路公里', f"{p['length']:.3f}", 0),
+            ('公路基本造价', '', p['total']),
+            ('第一部分 建筑安装工程费', '', p['build_install']),
+            ('路基工程', f"{p['length']:.3f}", p['subgrade']),
+            ('特殊路基处理', '', p['special_subgrade']),
+            ('路面工程', f"{p['length']:.3f}", p['pavement']),
+            ('桥梁涵洞工程', '', p['bridge']),
+            ('交通工程及沿线设施', '', p['traffic']),
+            ('第二部分 土地使用及拆迁补偿费', '', p['land']),
+        ]
+        encoding = 'gbk' if i % 3 == 0 else 'utf-8'
+        path = os.path.join(out_dir, f"{p['highway_grade']}_{p['project_type']}_合成项目{i:06d}.csv")
+        with open(path, 'w', encoding=encoding) as f:
+            f.write('项目名称,数量,金额\n')
+            for name, quantity, amount in rows:
+                f.write(f'{name},{quantity},"{amount:,.2f}"\n')
+
+def generate_feedback_rows(n_rows, seed=1):
+    """生成与 /feedback 请求体格式一致的合成反馈记录"""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n_rows):
+        p = synthetic_project(rng)
+        rows.append({
+            'route_length_km': p['length'],
+            'subgrade_cost_ratio': p['subgrade'] / p['build_install'],
+            'pavement_cost_ratio': p['pavement'] / p['build_install'],
+            'bridge_culvert_cost_ratio': p['bridge'] / p['build_install'],
+            'traffic_eng_cost_ratio': p['traffic'] / p['build_install'],
+            'special_subgrade_ratio': p['special_subgrade'] / p['subgrade'],
+            'land_acquisition_ratio': p['land'] / p['total'],
+            'highway_grade': p['highway_grade'],
+            'project_type': p['project_type'],
+            'pavement_cost_index': p['pavement'] / (p['length'] * 1000 * 20) / 700,
+            'total_cost_cny': p['total'],
+        })
+    return rows
+
+# --- 测量 ---
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def run_scale(n_projects, n_feedback, n_requests, concurrency, workdir):
+    """在独立的工作目录中跑一个规模的全部测量；需在设置好环境变量的新进程中调用"""
+    from feedback_store import FEEDBACK_DB_PATH, connect, _insert_many, validate_record
+    from ingestion import load_and_process_all_data, load_initial_features
+    from artifacts import MODEL_DIR, save_artifact
+    from training import build_artifact, train_model
+    from explain import build_explainer
+    import glob
+    import pandas as pd
+
+    results = {'projects': n_projects, 'feedback_rows': n_feedback}
+    data_path = os.path.join(workdir, 'data')
+    _, results['generate_csv_s'] = timed(generate_estimate_csvs, data_path, n_projects)
+    files = sorted(glob.glob(os.path.join(data_path, '*.csv')))
+    _, results['ingest_cold_s'] = timed(load_initial_features, files)
+    _, results['ingest_cached_s'] = timed(load_initial_features, files)
+
+    feedback_rows = generate_feedback_rows(n_feedback)
+    conn = connect(FEEDBACK_DB_PATH)
+    _, results['feedback_insert_s'] = timed(_insert_many, conn, [validate_record(r) for r in feedback_rows])
+    conn.close()
+
+    df, results['load_all_data_s'] = timed(load_and_process_all_data, data_path, FEEDBACK_DB_PATH)
+    (model_pipeline, _, all_feature_names), results['train_model_s'] = timed(train_model, df)
+    background = pd.DataFrame(
+        model_pipeline.named_steps['preprocessor'].transform(df.drop('total_cost_cny', axis=1)),
+        columns=all_feature_names
+    )
+    explainer, results['explainer_build_s'] = timed(build_explainer, model_pipeline, background)
+    _, results['shap_global_s'] = timed(explainer, background)
+    artifact, results['build_artifact_s'] = timed(build_artifact, df, n_feedback)
+    save_artifact(artifact, MODEL_DIR)
+
+    # 导入app会加载刚保存的产物
+    import app as estimator_app
+    client = estimator_app.app.test_client()
+    requests_rows = [{k: v for k, v in r.items() if k != 'total_cost_cny'} for r in generate_feedback_rows(n_requests, seed=2)]
+    latencies = []
+    for row in requests_rows:
+        start = time.perf_counter()
+        response = client.post('/predict', json=row)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"/predict 返回 {response.status_code}: {response.get_data(as_text=True)}")
+    results['predict_p50_ms'] = percentile(latencies, 50) * 1000
+    results['predict_p99_ms'] = percentile(latencies, 99) * 1000
+
+    def worker(rows):
+        worker_client = estimator_app.app.test_client()
+        for row in rows:
+            worker_client.post('/predict', json=row)
+    slices = [requests_rows[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, slices))
+    results['predict_throughput_rps'] = len(requests_rows) / (time.perf_counter() - start)
+
+    _, results['summary_plot_cold_s'] = timed(client.get, '/shap_summary_plot')
+    _, results['summary_plot_warm_s'] = timed(client.get, '/shap_summary_plot')
+    return results
+
+def run_scale_subprocess(n_projects, args):
+    """每个规模在独立子进程和临时目录中运行，避免模块级状态（已加载的模型、缓存）互相影响"""
+    with tempfile.TemporaryDirectory(prefix='estimator-bench-') as workdir:
+        env = dict(
+            os.environ,
+            MODEL_DIR=os.path.join(workdir, 'models'),
+            FEEDBACK_DB_PATH=os.path.join(workdir, 'feedback.db'),
+            INGEST_CACHE_PATH=os.path.join(workdir, 'cache', 'ingest_cache.json'),
+            SUMMARY_PLOT_CACHE_DIR=os.path.join(workdir, 'cache'),
+            RETRAIN_ENABLED='0',
+            PREDICT_CACHE_ENABLED='0',
+            # 导入app时同步加载模型，测量的是模型就绪后的服务性能
+            MODEL_WARMUP='eager',
+            DRIFT_STATE_DIR=os.path.join(workdir, 'cache', 'drift'),
+            METRICS_STATE_DIR=os.path.join(workdir, 'cache', 'metrics'),
+        )
+        command = [
+            sys.executable, os.path.abspath(__file__), '--single-scale', str(n_projects),
+            '--feedback-rows', str(args.feedback_rows if args.feedback_rows is not None else n_projects // 10),
+            '--requests', str(args.requests), '--concurrency', str(args.concurrency), '--workdir', workdir,
+        ]
+        output = subprocess.run(command, env=env, cwd=workdir, check=True, capture_output=True, text=True).stdout
+        # 子进程最后一行输出为JSON结果，之前是各模块的日志
+        return json.loads(output.strip().splitlines()[-1])
+
+def compare_with_baseline(results, baseline, tolerance=BENCHMARK_TOLERANCE):
+    """返回超出容差的性能回退列表"""
+    regressions = []
+    for scale, metrics in results['scales'].items():
+        base_metrics = baseline.get('scales', {}).get(scale)
+        if not base_metrics:
+            continue
+        for name, value in metrics.items():
+            base = base_metrics.get(name)
+            if not isinstance(base, (int, float)) or name in ('projects', 'feedback_rows') or base <= 0:
+                continue
+            if name in HIGHER_IS_BETTER:
+                change = (base - value) / base
+            else:
+                change = (value - base) / base
+                abs_delta_s = (value - base) / 1000 if name.endswith('_ms') else value - base
+                if abs_delta_s < BENCHMARK_MIN_ABS_DELTA_S:
+                    continue
+            if change > tolerance:
+                regressions.append({'scale': scale, 'metric': name, 'baseline': base, 'current': value, 'change': change})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='估算服务性能基准：合成数据、训练、解释器、预测延迟与吞吐')
+    parser.add_argument('--scales', default='10,100', help='逗号分隔的项目数规模，例如 10,100,1000,100000')
+    parser.add_argument('--feedback-rows', type=int, default=None, help='合成反馈条数，默认为项目数的10%%')
+    parser.add_argument('--requests', type=int, default=200, help='延迟与吞吐测量的 /predict 请求数')
+    parser.add_argument('--concurrency', type=int, default=8, help='吞吐测量的并发线程数')
+    parser.add_argument('--output', help='结果JSON输出路径，默认输出到标准输出')
+    parser.add_argument('--baseline', default=BENCHMARK_BASELINE_PATH, help='基线结果路径')
+    parser.add_argument('--tolerance', type=float, default=BENCHMARK_TOLERANCE, help='允许的性能回退比例')
+    parser.add_argument('--update-baseline', action='store_true', help='用本次结果覆盖基线')
+    parser.add_argument('--single-scale', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single_scale is not None:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        results = run_scale(args.single_scale, args.feedback_rows, args.requests, args.concurrency, args.workdir)
+        print(json.dumps(results))
+        return
+
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'scales': {},
+    }
+    for scale in [int(s) for s in args.scales.split(',') if s]:
+        print(f"正在运行规模 {scale} 的基准测试...", file=sys.stderr)
+        results['scales'][str(scale)] = run_scale_subprocess(scale, args)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    results['regressions'] = compare_with_baseline(results, baseline, args.tolerance) if baseline else []
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({k: v for k, v in results.items() if k != 'regressions'}, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"基线已更新: {args.baseline}", file=sys.stderr)
+    elif results['regressions']:
+        for r in results['regressions']:
+            print(f"性能回退: 规模{r['scale']} {r['metric']} {r['baseline']:.4g} -> {r['current']:.4g} ({r['change']:+.0%})", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
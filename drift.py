@@ -0,0 +1,243 @@
+import os
+import json
+import math
+import time
+import uuid
+import bisect
+import shutil
+import threading
+import numpy as np
+
+from background import ProcessThread
+from feedback_store import FEEDBACK_CATEGORICAL_COLS
+
+# --- 输入漂移监控设置 ---
+DRIFT_ENABLED = os.environ.get('DRIFT_ENABLED', '1') == '1'
+# 数值特征按训练数据的分位点分箱：DRIFT_BINS个箱，每个箱在训练数据中约占 1/DRIFT_BINS
+DRIFT_BINS = int(os.environ.get('DRIFT_BINS', 10))
+# 每个类别特征最多单独计数的类别数，超出的未知类别合并计入 __other__，内存占用与请求量无关
+DRIFT_MAX_CATEGORIES = int(os.environ.get('DRIFT_MAX_CATEGORIES', 32))
+# 任一特征的PSI超过此阈值且样本数达到下限时判定为漂移（PSI > 0.25 通常视为显著变化）
+DRIFT_PSI_THRESHOLD = float(os.environ.get('DRIFT_PSI_THRESHOLD', 0.25))
+DRIFT_MIN_SAMPLES = int(os.environ.get('DRIFT_MIN_SAMPLES', 200))
+# 各worker把自己的计数快照写入 DRIFT_STATE_DIR/<模型版本>/，查询时合并所有worker的快照
+DRIFT_STATE_DIR = os.environ.get('DRIFT_STATE_DIR', 'cache/drift')
+DRIFT_FLUSH_SECONDS = float(os.environ.get('DRIFT_FLUSH_SECONDS', 30))
+# 判定漂移时是否请求后台重新训练（默认关闭）
+DRIFT_RETRAIN_ENABLED = os.environ.get('DRIFT_RETRAIN_ENABLED', '0') == '1'
+OTHER_CATEGORY = '__other__'
+# 计算PSI时比例的下限，避免空箱取对数
+PSI_EPSILON = 1e-4
+
+def build_reference(training_data, training_cols, n_bins=DRIFT_BINS):
+    """由训练数据预先计算参考分布：数值特征的分位点箱边界及各箱计数，类别特征的各类别计数"""
+    reference = {'n': len(training_data), 'numeric': {}, 'categorical': {}}
+    for column in training_cols:
+        values = training_data[column]
+        if column in FEEDBACK_CATEGORICAL_COLS:
+            reference['categorical'][column] = {str(k): int(v) for k, v in values.value_counts().items()}
+            continue
+        values = values.to_numpy(dtype=np.float64)
+        values = values[~np.isnan(values)]
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1])).tolist() if len(values) else []
+        sketch = new_numeric_sketch(edges)
+        for value in values:
+            sketch['counts'][bisect.bisect_right(edges, value)] += 1
+        reference['numeric'][column] = {
+            'edges': edges,
+            'min': float(values.min()) if len(values) else None,
+            'max': float(values.max()) if len(values) else None,
+            'counts': sketch['counts'],
+        }
+    return reference
+
+def new_numeric_sketch(edges):
+    return {'counts': [0] * (len(edges) + 1), 'below_min': 0, 'above_max': 0, 'missing': 0}
+
+def new_sketch(reference):
+    return {
+        'n': 0,
+        'numeric': {c: new_numeric_sketch(r['edges']) for c, r in reference['numeric'].items()},
+        'categorical': {c: {} for c in reference['categorical']},
+    }
+
+def merge_sketches(sketches, reference):
+    """计数直接相加即可合并，多个worker的快照与单个进程看到全部请求的结果相同"""
+    merged = new_sketch(reference)
+    for sketch in sketches:
+        merged['n'] += sketch['n']
+        for column, numeric in sketch['numeric'].items():
+            target = merged['numeric'][column]
+            target['counts'] = [a + b for a, b in zip(target['counts'], numeric['counts'])]
+            for key in ('below_min', 'above_max', 'missing'):
+                target[key] += numeric[key]
+        for column, counts in sketch['categorical'].items():
+            target = merged['categorical'][column]
+            for category, count in counts.items():
+                target[category] = target.get(category, 0) + count
+    return merged
+
+def psi(reference_counts, live_counts):
+    """群体稳定性指数 PSI = Σ (实际占比 - 参考占比) × ln(实际占比 / 参考占比)"""
+    ref_total = sum(reference_counts) or 1
+    live_total = sum(live_counts) or 1
+    score = 0.0
+    for ref, live in zip(reference_counts, live_counts):
+        p_ref = max(ref / ref_total, PSI_EPSILON)
+        p_live = max(live / live_total, PSI_EPSILON)
+        score += (p_live - p_ref) * math.log(p_live / p_ref)
+    return score
+
+def drift_report(reference, sketch, threshold=DRIFT_PSI_THRESHOLD, min_samples=DRIFT_MIN_SAMPLES):
+    features = {}
+    for column, ref in reference['numeric'].items():
+        live = sketch['numeric'][column]
+        observed = sum(live['counts'])
+        features[column] = {
+            'psi': psi(ref['counts'], live['counts']) if observed else 0.0,
+            'samples': observed,
+            'missing': live['missing'],
+            # 超出训练数据取值范围的比例
+            'out_of_range': (live['below_min'] + live['above_max']) / observed if observed else 0.0,
+            'reference_range': [ref['min'], ref['max']],
+        }
+    for column, ref in reference['categorical'].items():
+        live = sketch['categorical'][column]
+        categories = sorted(set(ref) | set(live))
+        observed = sum(live.values())
+        features[column] = {
+            'psi': psi([ref.get(c, 0) for c in categories], [live.get(c, 0) for c in categories]) if observed else 0.0,
+            'samples': observed,
+            'unseen_categories': {c: n for c, n in live.items() if c not in ref},
+            'live_counts': live,
+        }
+    max_psi = max((f['psi'] for f in features.values()), default=0.0)
+    return {
+        'samples': sketch['n'],
+        'threshold': threshold,
+        'min_samples': min_samples,
+        'max_psi': max_psi,
+        'drifted': sketch['n'] >= min_samples and max_psi > threshold,
+        'features': features,
+    }
+
+class DriftMonitor:
+    """按模型版本统计 /predict 输入分布并与训练数据比较的漂移监控。
+
+    每个worker在内存中维护一份计数（数值特征按训练分位点分箱、类别特征按类别计数），
+    每次请求只做常数次二分查找和加法；后台线程定期把计数快照写入共享目录，
+    查询时合并所有worker的快照计算各特征的PSI。模型版本切换后以新的参考分布重新开始统计。
+    """
+
+    def __init__(self, on_drift=None, state_dir=DRIFT_STATE_DIR):
+        self.on_drift = on_drift
+        self.state_dir = state_dir
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._version = None
+        self._reference = None
+        self._sketch = None
+        self._snapshot_path = None
+        self._triggered_version = None
+        self._thread = ProcessThread(self._run, 'drift-monitor', before_start=self._forget_parent_state)
+
+    def ensure_started(self):
+        self._thread.start()
+
+    def _forget_parent_state(self):
+        # fork出的worker不能沿用主进程的快照文件名和计数
+        self._version = None
+        self._snapshot_path = None
+
+    def _reset(self, version, reference):
+        if self._snapshot_path is not None and os.path.exists(self._snapshot_path):
+            os.remove(self._snapshot_path)
+        # 只保留当前模型版本的快照目录。仍在旧版本上的worker下次写快照时会重建旧目录，
+        # 它切换到新版本时再次清理，目录数不会随重新训练的次数增长
+        if os.path.isdir(self.state_dir):
+            for name in os.listdir(self.state_dir):
+                if name != version and os.path.isdir(os.path.join(self.state_dir, name)):
+                    shutil.rmtree(os.path.join(self.state_dir, name), ignore_errors=True)
+        self._version = version
+        self._reference = reference
+        self._sketch = new_sketch(reference)
+        self._snapshot_path = os.path.join(self.state_dir, version, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        self.last_report = None
+
+    def observe(self, version, reference, data):
+        """记录一条预测请求的原始输入"""
+        with self._lock:
+            if version != self._version:
+                self._reset(version, reference)
+            sketch = self._sketch
+            sketch['n'] += 1
+            for column, ref in reference['numeric'].items():
+                target = sketch['numeric'][column]
+                value = data.get(column)
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = math.nan
+                if math.isnan(value):
+                    target['missing'] += 1
+                    continue
+                target['counts'][bisect.bisect_right(ref['edges'], value)] += 1
+                if ref['min'] is not None and value < ref['min']:
+                    target['below_min'] += 1
+                elif ref['max'] is not None and value > ref['max']:
+                    target['above_max'] += 1
+            for column, ref in reference['categorical'].items():
+                counts = sketch['categorical'][column]
+                category = str(data.get(column))
+                if category not in ref and category not in counts and len(counts) >= DRIFT_MAX_CATEGORIES:
+                    category = OTHER_CATEGORY
+                counts[category] = counts.get(category, 0) + 1
+
+    def flush(self):
+        """把本worker的计数快照原子地写入共享目录"""
+        with self._lock:
+            if self._sketch is None:
+                return
+            path = self._snapshot_path
+            payload = json.dumps({'version': self._version, 'updated_at': time.time(), 'sketch': self._sketch}, ensure_ascii=False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(path + '.tmp', path)
+
+    def report(self, version, reference):
+        """合并所有worker在该模型版本下的快照并计算漂移分数"""
+        self.flush()
+        sketches = []
+        version_dir = os.path.join(self.state_dir, version)
+        if os.path.isdir(version_dir):
+            for name in os.listdir(version_dir):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(version_dir, name), encoding='utf-8') as f:
+                        sketches.append(json.load(f)['sketch'])
+                except (OSError, ValueError, KeyError):
+                    continue
+        report = drift_report(reference, merge_sketches(sketches, reference))
+        report['model_version'] = version
+        report['workers'] = len(sketches)
+        if version == self._version:
+            self.last_report = report
+        return report
+
+    def _run(self):
+        while True:
+            time.sleep(DRIFT_FLUSH_SECONDS)
+            try:
+                with self._lock:
+                    version, reference = self._version, self._reference
+                if version is None:
+                    continue
+                report = self.report(version, reference)
+                if report['drifted'] and self.on_drift is not None and self._triggered_version != version:
+                    # 每个模型版本只触发一次，重新训练出新版本后重新开始统计
+                    self._triggered_version = version
+                    self.on_drift(report)
+            except Exception as e:
+                print(f"漂移监控更新失败: {e}")
@@ -0,0 +1,157 @@
+import time
+import threading
+import numpy as np
+
+# --- 一致性检查的误差上限 ---
+# 编码后的特征与 preprocessor.transform 的结果、以及预测值（相对于预测值的最大绝对值）都应逐位一致，只留浮点舍入余量
+ENCODER_FEATURE_ATOL = 1e-9
+ENCODER_PREDICTION_RTOL = 1e-6
+
+class FeatureEncoder:
+    """由已拟合的 ColumnTransformer 编译出的单行特征编码器。
+
+    训练完成后把 StandardScaler 的均值/标准差提取为NumPy数组、把 OneHotEncoder 的类别
+    提取为“取值 -> 输出列下标”的映射，预测时直接把请求字典写入预分配的向量，
+    不再构造DataFrame、也不再调用 preprocessor.transform。结果与流水线逐位一致。
+    """
+
+    def __init__(self, preprocessor, training_cols):
+        self.training_cols = list(training_cols)
+        self.numeric_cols = []
+        self.numeric_index = []
+        self.categorical = []
+        offset = 0
+        for name, transformer, columns in preprocessor.transformers_:
+            if name == 'num':
+                self.numeric_cols = list(columns)
+                self.numeric_index = np.arange(offset, offset + len(columns))
+                self.mean = transformer.mean_ if transformer.with_mean else np.zeros(len(columns))
+                self.scale = transformer.scale_ if transformer.with_std else np.ones(len(columns))
+                offset += len(columns)
+            elif name == 'cat':
+                for column, categories in zip(columns, transformer.categories_):
+                    index_map = {category: offset + i for i, category in enumerate(categories)}
+                    self.categorical.append((column, index_map))
+                    offset += len(categories)
+            elif transformer != 'drop' and len(columns):
+                raise ValueError(f"FeatureEncoder不支持的转换器: {name}")
+        self.n_features = offset
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @classmethod
+    def from_pipeline(cls, model_pipeline, training_cols):
+        return cls(model_pipeline.named_steps['preprocessor'], training_cols)
+
+    def _buffers(self):
+        # 每个线程一组预分配缓冲区，并发请求之间互不覆盖
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = (np.empty(self.n_features, dtype=np.float64), np.empty((1, self.n_features), dtype=np.float32))
+            self._local.buffers = buffers
+        return buffers
+
+    def encode(self, data):
+        """把请求字典编码为 (float64特征行, 可直接送入booster的float32矩阵)。
+
+        返回的是本线程的缓冲区，下次调用会被覆盖，需要保留时请自行拷贝。
+        缺失或为null的数值特征按NaN处理（与流水线一致），未知类别对应的独热列全为0。
+        """
+        row, model_input = self._buffers()
+        raw = np.array([_to_float(data.get(c)) for c in self.numeric_cols], dtype=np.float64)
+        row[self.numeric_index] = (raw - self.mean) / self.scale
+        row[len(self.numeric_cols):] = 0.0
+        for column, index_map in self.categorical:
+            index = index_map.get(data.get(column))
+            if index is not None:
+                row[index] = 1.0
+        model_input[0] = row
+        return row, model_input
+
+    def encode_values(self, column, values):
+        """把某一输入列的多个取值编码为 (该列在编码向量中的下标, 形状为 (取值数, 下标数) 的矩阵)。
+
+        数值列占一个位置；类别列占其独热编码的全部位置，未知类别对应全0行。
+        """
+        if column in self.numeric_cols:
+            k = self.numeric_cols.index(column)
+            raw = np.array([_to_float(v) for v in values], dtype=np.float64)
+            return self.numeric_index[k:k + 1], ((raw - self.mean[k]) / self.scale[k])[:, None]
+        for name, index_map in self.categorical:
+            if name == column:
+                index = np.array(sorted(index_map.values()))
+                block = np.zeros((len(values), len(index)), dtype=np.float64)
+                for i, value in enumerate(values):
+                    if value in index_map:
+                        block[i, index_map[value] - index[0]] = 1.0
+                return index, block
+        raise ValueError(f"未知的特征列: {column}")
+
+def _to_float(value):
+    return np.nan if value is None else float(value)
+
+def compare_with_pipeline(model_pipeline, encoder, rows, repeat=200):
+    """逐行对比编码器与流水线的特征和预测结果，并测量单行预测耗时（毫秒）"""
+    import pandas as pd
+
+    preprocessor = model_pipeline.named_steps['preprocessor']
+    booster = model_pipeline.named_steps['regressor'].get_booster()
+    max_feature_diff = 0.0
+    max_prediction_diff = 0.0
+    max_prediction = 0.0
+    for data in rows:
+        expected_row = preprocessor.transform(pd.DataFrame([data], columns=encoder.training_cols))[0]
+        expected_prediction = model_pipeline.predict(pd.DataFrame([data], columns=encoder.training_cols))[0]
+        row, model_input = encoder.encode(data)
+        prediction = booster.inplace_predict(model_input)[0]
+        # 缺失值两边都是NaN，位置不一致时差值为NaN，检查不会通过
+        feature_diff = np.where(np.isnan(row) & np.isnan(expected_row), 0.0, np.abs(row - expected_row))
+        # np.max会传播NaN；内置max(x, nan)返回x，会把不一致吞掉
+        max_feature_diff = float(np.max([max_feature_diff, feature_diff.max()]))
+        max_prediction_diff = max(max_prediction_diff, float(abs(prediction - expected_prediction)))
+        max_prediction = max(max_prediction, float(abs(expected_prediction)))
+
+    data = rows[0]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        model_pipeline.predict(pd.DataFrame([data], columns=encoder.training_cols))
+    pipeline_ms = (time.perf_counter() - start) / repeat * 1000
+    start = time.perf_counter()
+    for _ in range(repeat):
+        booster.inplace_predict(encoder.encode(data)[1])
+    encoder_ms = (time.perf_counter() - start) / repeat * 1000
+    return {
+        'rows': len(rows),
+        'max_feature_abs_diff': max_feature_diff,
+        'max_prediction_abs_diff': max_prediction_diff,
+        'max_prediction_rel_diff': max_prediction_diff / (max_prediction or 1.0),
+        'pipeline_predict_ms': pipeline_ms,
+        'encoder_predict_ms': encoder_ms,
+    }
+
+def main():
+    from parity import check_report, load_training_rows, make_parser, require_latest_artifact
+
+    parser = make_parser('验证编译特征编码器与流水线结果一致，并对比单行预测耗时', with_data=True)
+    parser.add_argument('--repeat', type=int, default=200, help='耗时测量的重复次数')
+    args = parser.parse_args()
+
+    artifact = require_latest_artifact(args.model_dir)
+    rows = load_training_rows(artifact, args).to_dict('records')
+    encoder = artifact.get('feature_encoder') or FeatureEncoder.from_pipeline(artifact['model_pipeline'], artifact['training_cols'])
+    report = compare_with_pipeline(artifact['model_pipeline'], encoder, rows, args.repeat)
+    check_report(report, {
+        'max_feature_abs_diff': ENCODER_FEATURE_ATOL,
+        'max_prediction_rel_diff': ENCODER_PREDICTION_RTOL,
+    })
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+import os
+import json
+import math
+import time
+import queue
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+from background import ProcessThread
+
+# --- 文件路径定义 ---
+# 在容器内部，我们将反馈数据存储在/app/feedback_storage/目录下
+FEEDBACK_DB_PATH = os.environ.get('FEEDBACK_DB_PATH', '/app/feedback_storage/feedback.db')
+# 旧版按请求追加写入的CSV反馈文件；若存在，启动时一次性导入数据库后改名为 *.migrated
+FEEDBACK_FILE_PATH = '/app/feedback_storage/feedback_data.csv'
+
+# --- 批量提交设置 ---
+# 写入线程攒批提交：最多等待这么久，或攒满这么多条就提交一次事务
+FEEDBACK_FLUSH_INTERVAL_MS = float(os.environ.get('FEEDBACK_FLUSH_INTERVAL_MS', 20))
+FEEDBACK_MAX_BATCH = int(os.environ.get('FEEDBACK_MAX_BATCH', 256))
+# 请求等待其记录提交完成的最长时间
+FEEDBACK_COMMIT_TIMEOUT_SECONDS = float(os.environ.get('FEEDBACK_COMMIT_TIMEOUT_SECONDS', 10))
+
+# 反馈记录的字段：与训练特征（TRAINING_COLS）一致，外加真实造价
+FEEDBACK_CATEGORICAL_COLS = ['highway_grade', 'project_type']
+FEEDBACK_FEATURE_COLS = [
+    'route_length_km', 'subgrade_cost_ratio', 'pavement_cost_ratio', 'bridge_culvert_cost_ratio',
+    'traffic_eng_cost_ratio', 'special_subgrade_ratio', 'land_acquisition_ratio',
+    'highway_grade', 'project_type', 'pavement_cost_index'
+]
+FEEDBACK_TARGET_COL = 'total_cost_cny'
+
+def validate_record(data, training_cols=FEEDBACK_FEATURE_COLS):
+    """按TRAINING_COLS校验并规范化一条反馈记录，返回只含已知字段的新字典"""
+    if not isinstance(data, dict):
+        raise ValueError('反馈数据必须是JSON对象。')
+    unknown = [c for c in training_cols if c not in FEEDBACK_FEATURE_COLS]
+    if unknown:
+        raise ValueError(f'反馈存储不支持的特征列: {unknown}')
+    missing = [c for c in list(training_cols) + [FEEDBACK_TARGET_COL] if data.get(c) in (None, '')]
+    if missing:
+        raise ValueError(f'反馈数据缺少必要字段: {missing}')
+    record = {}
+    for column in training_cols:
+        value = data[column]
+        if column in FEEDBACK_CATEGORICAL_COLS:
+            if not isinstance(value, str):
+                raise ValueError(f'字段 {column} 必须是字符串。')
+            record[column] = value
+        else:
+            record[column] = _to_finite_float(column, value)
+    record[FEEDBACK_TARGET_COL] = _to_finite_float(FEEDBACK_TARGET_COL, data[FEEDBACK_TARGET_COL])
+    if record[FEEDBACK_TARGET_COL] <= 0:
+        raise ValueError(f'字段 {FEEDBACK_TARGET_COL} 必须大于0。')
+    return record
+
+def _to_finite_float(column, value):
+    # float()也接受NaN和±Infinity（Flask的get_json会解析这两个字面量），它们一旦入库就会让训练失败
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'字段 {column} 必须是数值。')
+    if not math.isfinite(value):
+        raise ValueError(f'字段 {column} 必须是有限数值。')
+    return value
+
+def record_hash(record):
+    """规范化记录的哈希，用于识别重复提交"""
+    canonical = json.dumps([record.get(c) for c in FEEDBACK_FEATURE_COLS + [FEEDBACK_TARGET_COL]], ensure_ascii=False)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+def connect(db_path=FEEDBACK_DB_PATH):
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    columns = ', '.join(
+        f"{c} TEXT" if c in FEEDBACK_CATEGORICAL_COLS else f"{c} REAL" for c in FEEDBACK_FEATURE_COLS
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS feedback ('
+        'id INTEGER PRIMARY KEY AUTOINCREMENT, record_hash TEXT NOT NULL UNIQUE, created_at REAL NOT NULL, '
+        f'{columns}, {FEEDBACK_TARGET_COL} REAL NOT NULL)'
+    )
+    return conn
+
+def _insert_many(conn, records):
+    """在一个事务中插入多条记录，返回每条是否为新记录（重复提交返回False）"""
+    columns = ['record_hash', 'created_at'] + FEEDBACK_FEATURE_COLS + [FEEDBACK_TARGET_COL]
+    # 只忽略record_hash重复的记录；其他约束错误照常抛出，不会被当作重复提交
+    sql = (f"INSERT INTO feedback ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+           "ON CONFLICT(record_hash) DO NOTHING")
+    now = time.time()
+    inserted = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for record in records:
+            cursor = conn.execute(sql, [record_hash(record), now] + [record.get(c) for c in columns[2:]])
+            inserted.append(cursor.rowcount == 1)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return inserted
+
+def read_feedback(db_path=FEEDBACK_DB_PATH):
+    """训练用的批量读取：一次查询取出全部反馈，列顺序与训练数据一致"""
+    import pandas as pd
+
+    if not os.path.exists(db_path):
+        return pd.DataFrame(columns=FEEDBACK_FEATURE_COLS + [FEEDBACK_TARGET_COL])
+    conn = connect(db_path)
+    try:
+        return pd.read_sql_query(
+            f"SELECT {', '.join(FEEDBACK_FEATURE_COLS + [FEEDBACK_TARGET_COL])} FROM feedback ORDER BY id", conn
+        )
+    finally:
+        conn.close()
+
+def feedback_source(position):
+    """第position条（从0开始，按写入顺序）反馈记录的来源标注"""
+    return f"反馈#{position + 1}"
+
+def read_feedback_since(db_path=FEEDBACK_DB_PATH, offset=0):
+    """按写入顺序读取第offset条之后的反馈记录（字典列表），用于增量跟进新反馈"""
+    if not os.path.exists(db_path):
+        return []
+    columns = FEEDBACK_FEATURE_COLS + [FEEDBACK_TARGET_COL]
+    conn = connect(db_path)
+    try:
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM feedback ORDER BY id LIMIT -1 OFFSET ?", (offset,))
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def count_feedback(db_path=FEEDBACK_DB_PATH):
+    if not os.path.exists(db_path):
+        return 0
+    conn = connect(db_path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM feedback').fetchone()[0]
+    finally:
+        conn.close()
+
+def import_csv(csv_path=FEEDBACK_FILE_PATH, db_path=FEEDBACK_DB_PATH):
+    """把旧版CSV反馈文件一次性导入数据库，成功后把CSV改名为 *.migrated，返回(导入条数, 重复条数, 跳过条数)。
+
+    校验不通过的行（如类别为空、数值非有限）逐行报告后跳过，不影响其余反馈的导入；原始文件随 *.migrated 保留。
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    records, skipped = [], 0
+    for line_number, row in enumerate(df.to_dict('records'), start=2):
+        try:
+            records.append(validate_record(row))
+        except ValueError as e:
+            skipped += 1
+            print(f"旧版反馈CSV第{line_number}行无效，已跳过: {e}")
+    conn = connect(db_path)
+    try:
+        inserted = _insert_many(conn, records) if records else []
+    finally:
+        conn.close()
+    os.replace(csv_path, csv_path + '.migrated')
+    imported = sum(inserted)
+    print(f"旧版反馈CSV已导入: {csv_path}，新增{imported}条，重复{len(inserted) - imported}条，跳过无效行{skipped}条。")
+    return imported, len(inserted) - imported, skipped
+
+class FeedbackStore:
+    """单写入线程、按批提交（group commit）的反馈存储。
+
+    请求线程只把校验后的记录放进队列并等待提交结果；写入线程在FEEDBACK_FLUSH_INTERVAL_MS
+    窗口内把多条记录合并到同一个事务中提交。多个gunicorn worker之间由SQLite WAL模式的
+    文件锁串行化写入，重复提交由record_hash上的唯一索引去重。
+    """
+
+    def __init__(self, db_path=FEEDBACK_DB_PATH, flush_interval_ms=FEEDBACK_FLUSH_INTERVAL_MS,
+                 max_batch=FEEDBACK_MAX_BATCH):
+        self.db_path = db_path
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = ProcessThread(self._run, 'feedback-writer', before_start=self._new_queue)
+        connect(db_path).close()
+
+    def _new_queue(self):
+        # 主进程队列中残留的条目属于已不存在的请求线程
+        self._queue = queue.Queue()
+
+    def submit(self, data, training_cols=FEEDBACK_FEATURE_COLS):
+        """校验并写入一条反馈，阻塞到其所在批次提交完成；返回是否为新记录（False表示重复提交）"""
+        record = validate_record(data, training_cols)
+        self._thread.start()
+        item = {'record': record, 'done': threading.Event(), 'inserted': None, 'error': None}
+        self._queue.put(item)
+        if not item['done'].wait(FEEDBACK_COMMIT_TIMEOUT_SECONDS):
+            raise TimeoutError('反馈写入超时。')
+        if item['error'] is not None:
+            raise item['error']
+        return item['inserted']
+
+    def _run(self):
+        conn = connect(self.db_path)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                for item, inserted in zip(batch, _insert_many(conn, [item['record'] for item in batch])):
+                    item['inserted'] = inserted
+            except Exception as e:
+                for item in batch:
+                    item['error'] = e
+            for item in batch:
+                item['done'].set()
+
+    def count(self):
+        return count_feedback(self.db_path)
+
+    def read_dataframe(self):
+        return read_feedback(self.db_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='把旧版CSV反馈文件导入SQLite反馈存储')
+    parser.add_argument('--csv-path', default=FEEDBACK_FILE_PATH, help='旧版CSV反馈文件路径')
+    parser.add_argument('--db-path', default=FEEDBACK_DB_PATH, help='SQLite反馈数据库路径')
+    args = parser.parse_args()
+    import_csv(args.csv_path, args.db_path)
+
+if __name__ == '__main__':
+    main()
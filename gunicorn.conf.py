@@ -0,0 +1,24 @@
+import os
+
+# --- gunicorn 配置 ---
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+# 每个worker的请求线程数；开启 PREDICT_BATCHING_ENABLED 时需大于1，并发的单行预测才能合并成批
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+# 已有模型产物时（MODEL_WARMUP=auto，默认）模型在主进程加载，各worker通过fork共享；首次部署时由各worker后台训练
+preload_app = True
+
+def on_starting(server):
+    # 在主进程中确定本次运行的指标目录（不预加载应用时worker也通过fork继承同一个目录），并删除上次运行留下的目录
+    from metrics import prune_metrics_state
+    prune_metrics_state()
+
+def when_ready(server):
+    # 主进程在fork前记录的观测值（如在主进程加载模型时的启动阶段耗时）写成主进程自己的快照
+    from app import metrics_aggregator
+    metrics_aggregator.flush()
+
+def post_fork(server, worker):
+    # 线程不会随fork继承：每个worker启动后立即开始后台预热，不必等首个请求
+    from app import start_warmup
+    start_warmup()
@@ -0,0 +1,266 @@
+import os
+import io
+import re
+import glob
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from feedback_store import FEEDBACK_DB_PATH, count_feedback, feedback_source, read_feedback
+
+# --- 初始数据解析缓存设置 ---
+# 缓存按文件路径记录大小、修改时间、内容哈希、成功解码的编码以及提取出的特征行；
+# 只有新增或内容变化的文件才会被重新解析
+INGEST_CACHE_PATH = os.environ.get('INGEST_CACHE_PATH', 'cache/ingest_cache.json')
+# 解析进程数；待解析文件少于INGEST_PARALLEL_MIN_FILES时直接在当前进程串行解析，省去进程池开销
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', os.cpu_count() or 1))
+INGEST_PARALLEL_MIN_FILES = int(os.environ.get('INGEST_PARALLEL_MIN_FILES', 8))
+CSV_ENCODINGS = ['utf-8', 'gbk']
+# 训练数据中每行来源的标注保存在DataFrame的这个attrs键下
+PROJECT_SOURCE_ATTR = 'project_source'
+# 本次实际读到的反馈条数；产物的n_feedback_rows必须取这个值，而不是另行查询数据库
+FEEDBACK_ROWS_ATTR = 'n_feedback_rows'
+
+# --- 行项目分类表 ---
+# 类别 -> 项目名称中的关键词。新增成本类别（如隧道、互通立交）只需在此追加一行，
+# 所有类别由同一个编译好的正则在一次调用中完成匹配；关键词之间可以互相包含（如“隧道”与“特长隧道”），
+# 与逐类别 str.contains 的结果相同
+COST_CATEGORIES = {
+    'route_length': '公路公里',
+    'total_cost': '公路基本造价', 'build_install_cost': '建筑安装工程费',
+    'subgrade_cost': '路基工程', 'pavement_cost': '路面工程',
+    'bridge_culvert_cost': '桥梁涵洞工程', 'traffic_eng_cost': '交通工程及沿线设施',
+    'special_subgrade_cost': '特殊路基处理', 'land_acquisition_cost': '土地使用及拆迁补偿费',
+    'total_cost_fallback': '第一至四部分合计',
+}
+# parse_cost_data 返回的造价类别
+COST_KEYS = [
+    'total_cost', 'build_install_cost', 'subgrade_cost', 'pavement_cost',
+    'bridge_culvert_cost', 'traffic_eng_cost', 'special_subgrade_cost', 'land_acquisition_cost'
+]
+
+class LineItemClassifier:
+    """单次扫描的行项目分类器：一次正则匹配为每个行项目打上其包含的全部类别标签。"""
+
+    def __init__(self, categories=COST_CATEGORIES):
+        self.categories = dict(categories)
+        self._keys = np.array(list(self.categories), dtype=object)
+        # 每个类别一个可选的前瞻分组，各自从行首查找自己的关键词：匹配互不消耗字符，
+        # 一个关键词包含另一个时两个类别都能命中（交替式正则只会命中其中一个）
+        self.pattern = re.compile(
+            '^' + ''.join(f'(?:(?=.*?({re.escape(term)})))?' for term in self.categories.values()), re.DOTALL
+        )
+
+    def tag(self, names):
+        """返回以行号（从0开始的位置）为索引、值为类别的Series，按行号排列；同一行命中多个类别时出现多次"""
+        matched = names.astype(str).reset_index(drop=True).str.extract(self.pattern).notna().to_numpy()
+        rows, columns = np.nonzero(matched)
+        return pd.Series(self._keys[columns], index=rows)
+
+    def first_rows(self, df, by=None):
+        """每个类别（按by分组时为每组每个类别）首个匹配行的行号（位置，而非索引标签）。
+
+        df可以是多个文件的行项目直接拼接而成（索引标签可以重复），用by列（如文件序号）区分，仍然只扫描一次。
+        """
+        tags = self.tag(df['项目名称'])
+        positions = tags.index.to_numpy()
+        tagged = pd.DataFrame({'category': tags.to_numpy(), 'row': positions})
+        keys = ['category']
+        if by is not None:
+            tagged.insert(0, by, df[by].to_numpy()[positions])
+            keys = [by, 'category']
+        return tagged.drop_duplicates(keys, keep='first').reset_index(drop=True)
+
+LINE_ITEM_CLASSIFIER = LineItemClassifier()
+
+# --- 数据处理逻辑 ---
+def parse_cost_data(df, first_rows=None):
+    df['金额'] = df['金额'].astype(str).str.replace(',', '').astype(float)
+    if first_rows is None:
+        first_rows = dict(LINE_ITEM_CLASSIFIER.first_rows(df)[['category', 'row']].itertuples(index=False))
+    amounts = df['金额']
+    costs = {key: amounts.iat[first_rows[key]] if key in first_rows else 0 for key in COST_KEYS}
+    if costs['total_cost'] == 0 and 'total_cost_fallback' in first_rows:
+        costs['total_cost'] = amounts.iat[first_rows['total_cost_fallback']]
+    return costs
+
+def decode_csv_bytes(raw, encoding_hint=None):
+    """只读一次文件字节，按编码候选在内存中解码，返回(文本, 成功的编码)。
+
+    优先尝试缓存中记录的编码；解码结果的表头必须包含'项目名称'，避免用错误编码“成功”解出乱码。
+    """
+    encodings = CSV_ENCODINGS if encoding_hint is None else [encoding_hint] + [e for e in CSV_ENCODINGS if e != encoding_hint]
+    for encoding in encodings:
+        try:
+            text = raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        if '项目名称' in text.split('\n', 1)[0]:
+            return text, encoding
+    raise ValueError(f"无法识别文件编码（已尝试 {', '.join(encodings)}）")
+
+def process_single_file(filepath, encoding_hint=None):
+    return extract_file_features(filepath, encoding_hint)['features']
+
+def extract_file_features(filepath, encoding_hint=None, known_sha1=None):
+    """解析单个估算CSV，返回特征行及缓存所需的元数据。
+
+    若文件内容哈希与known_sha1相同，说明只是修改时间变了，跳过解析并返回features=None。
+    """
+    return extract_files_features([(filepath, encoding_hint, known_sha1)])[0]
+
+def extract_files_features(tasks):
+    """解析一组估算CSV，tasks为 (文件路径, 编码提示, 已知哈希) 列表，按顺序返回各文件的缓存条目。
+
+    需要解析的文件的行项目拼接成一张表，由行项目分类器一次扫描完成全部文件的分类。
+    """
+    entries, frames = [], []
+    for filepath, encoding_hint, known_sha1 in tasks:
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        stat = os.stat(filepath)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': hashlib.sha1(raw).hexdigest()}
+        entries.append(entry)
+        if entry['sha1'] == known_sha1:
+            entry.update(encoding=encoding_hint, features=None)
+            continue
+        text, entry['encoding'] = decode_csv_bytes(raw, encoding_hint)
+        frames.append((len(entries) - 1, filepath, pd.read_csv(io.StringIO(text))))
+    if not frames:
+        return entries
+    combined = pd.concat(
+        [df[['项目名称']].assign(file=i) for i, (_, _, df) in enumerate(frames)]
+    )
+    first_rows = {i: {} for i in range(len(frames))}
+    offsets = np.cumsum([0] + [len(df) for _, _, df in frames])
+    for file, category, row in LINE_ITEM_CLASSIFIER.first_rows(combined, by='file').itertuples(index=False):
+        first_rows[file][category] = row - offsets[file]
+    for i, (entry_index, filepath, df) in enumerate(frames):
+        entries[entry_index]['features'] = features_from_frame(df, filepath, first_rows[i])
+    return entries
+
+def features_from_frame(df, filepath, first_rows=None):
+    """由单个文件的行项目计算特征行；first_rows为各类别首个匹配行的行号，未提供时现场分类"""
+    if first_rows is None:
+        first_rows = dict(LINE_ITEM_CLASSIFIER.first_rows(df)[['category', 'row']].itertuples(index=False))
+    route_length_km = float(df['数量'].iat[first_rows['route_length']]) if 'route_length' in first_rows else 1.0
+    costs = parse_cost_data(df, first_rows)
+    build_install_cost = costs['build_install_cost'] if costs['build_install_cost'] > 0 else 1
+    total_cost = costs['total_cost'] if costs['total_cost'] > 0 else 1
+    subgrade_cost_total = costs['subgrade_cost'] if costs['subgrade_cost'] > 0 else 1
+    features = {
+        'route_length_km': route_length_km,
+        'subgrade_cost_ratio': costs['subgrade_cost'] / build_install_cost,
+        'pavement_cost_ratio': costs['pavement_cost'] / build_install_cost,
+        'bridge_culvert_cost_ratio': costs['bridge_culvert_cost'] / build_install_cost,
+        'traffic_eng_cost_ratio': costs['traffic_eng_cost'] / build_install_cost,
+        'special_subgrade_ratio': costs['special_subgrade_cost'] / subgrade_cost_total,
+        'land_acquisition_ratio': costs['land_acquisition_cost'] / total_cost,
+        'total_cost_cny': costs['total_cost']
+    }
+    if '一级' in filepath or '高速' in filepath: features['highway_grade'] = '一级'
+    elif '三级' in filepath: features['highway_grade'] = '三级'
+    else: features['highway_grade'] = '二级'
+    features['project_type'] = '新建' if '新建' in filepath else '改扩建'
+    pavement_area = features['route_length_km'] * 1000 * 20 
+    pavement_area = pavement_area if pavement_area > 0 else 1
+    actual_pavement_unit_cost = costs['pavement_cost'] / pavement_area
+    standard_pavement_unit_cost = 700 
+    features['pavement_cost_index'] = actual_pavement_unit_cost / standard_pavement_unit_cost
+    return features
+
+def load_ingest_cache(cache_path=INGEST_CACHE_PATH):
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"解析缓存不可用，将重新解析全部文件: {e}")
+        return {}
+
+def save_ingest_cache(cache, cache_path=INGEST_CACHE_PATH):
+    if not cache_path:
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"无法写入解析缓存: {e}")
+
+def _extract_chunk(tasks):
+    return extract_files_features(tasks)
+
+def load_initial_features(files, cache_path=INGEST_CACHE_PATH):
+    """解析初始估算文件：命中缓存的直接复用，其余文件在进程池中并行解析"""
+    cache = load_ingest_cache(cache_path)
+    tasks = []
+    for filepath in files:
+        cached = cache.get(filepath)
+        if cached is None:
+            tasks.append((filepath, None, None))
+            continue
+        stat = os.stat(filepath)
+        if cached['size'] != stat.st_size or cached['mtime_ns'] != stat.st_mtime_ns:
+            tasks.append((filepath, cached['encoding'], cached['sha1']))
+
+    if len(tasks) >= INGEST_PARALLEL_MIN_FILES and INGEST_WORKERS > 1:
+        # 每个进程一次处理一组文件，组内行项目拼接后一次完成分类
+        chunk_size = max(1, len(tasks) // (INGEST_WORKERS * 4))
+        chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+        # 使用spawn而非fork：调用方可能是带有后台线程的服务进程
+        with ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = [entry for entries in pool.map(_extract_chunk, chunks) for entry in entries]
+    else:
+        results = _extract_chunk(tasks) if tasks else []
+
+    for (filepath, _, _), entry in zip(tasks, results):
+        if entry['features'] is None:
+            entry['features'] = cache[filepath]['features']
+        cache[filepath] = entry
+    if tasks or len(cache) != len(files):
+        save_ingest_cache({f: cache[f] for f in files}, cache_path)
+    print(f"初始数据解析完成。共{len(files)}个文件，重新解析{len(tasks)}个，命中缓存{len(files) - len(tasks)}个。")
+    return [cache[f]['features'] for f in files]
+
+def load_and_process_all_data(data_path='data', feedback_path=FEEDBACK_DB_PATH):
+    """加载初始数据和所有反馈数据。
+
+    每行的来源（初始数据为文件名，反馈为“反馈#序号”）记录在 df.attrs['project_source'] 中，
+    不作为列返回，训练特征保持不变；相似项目检索用它标注每个历史项目。
+    读到的反馈条数记录在 df.attrs['n_feedback_rows'] 中：读取期间新写入的反馈不会被漏计或重复训练。
+    """
+    # 加载初始数据
+    initial_files = sorted(glob.glob(os.path.join(data_path, '*.csv')))
+    if not initial_files:
+        raise FileNotFoundError(f"在 '{data_path}' 目录下未找到任何初始CSV数据文件。")
+    
+    initial_features = load_initial_features(initial_files)
+    df_initial = pd.DataFrame(initial_features)
+    sources = [os.path.splitext(os.path.basename(f))[0] for f in initial_files]
+    
+    # 加载反馈数据
+    df_feedback = read_feedback(feedback_path)
+    if len(df_feedback):
+        print(f"发现反馈数据: {feedback_path}")
+        # 合并新旧数据
+        df_combined = pd.concat([df_initial, df_feedback], ignore_index=True)
+        df_combined.attrs[PROJECT_SOURCE_ATTR] = sources + [feedback_source(i) for i in range(len(df_feedback))]
+        df_combined.attrs[FEEDBACK_ROWS_ATTR] = len(df_feedback)
+        print(f"数据合并完成。初始数据: {len(df_initial)}条, 反馈数据: {len(df_feedback)}条, 总计: {len(df_combined)}条。")
+        return df_combined
+    else:
+        print("未发现反馈数据，仅使用初始数据进行训练。")
+        df_initial.attrs[PROJECT_SOURCE_ATTR] = sources
+        df_initial.attrs[FEEDBACK_ROWS_ATTR] = 0
+        return df_initial
+
+def count_feedback_rows(feedback_path=FEEDBACK_DB_PATH):
+    """统计反馈数据行数，用于判断是否需要后台重新训练"""
+    return count_feedback(feedback_path)
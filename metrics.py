@@ -0,0 +1,401 @@
+import os
+import io
+import json
+import time
+import uuid
+import fcntl
+import pstats
+import shutil
+import cProfile
+import threading
+from contextlib import contextmanager
+
+from background import ProcessThread
+
+# --- 延迟直方图设置 ---
+# 以秒为单位的桶上界，覆盖从亚毫秒级的单行预测到秒级的训练
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# --- 慢请求采样分析设置（运行时可通过 /metrics/profiling 修改） ---
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.01))
+PROFILING_SLOW_MS = float(os.environ.get('PROFILING_SLOW_MS', 200))
+PROFILING_KEEP = 20
+# 各worker每隔这么久重新读取一次共享的采样分析设置
+PROFILING_SETTINGS_CHECK_SECONDS = 1.0
+
+# --- 多worker指标汇总设置 ---
+# 每个进程把自己的直方图和计数器快照写入 METRICS_STATE_DIR 下本次运行的子目录，/metrics 合并所有进程的快照后输出，
+# 无论抓取落到哪个worker结果都相同。已退出worker的快照并入 retired.json 后删除，计数器不会因worker重启而回退。
+# 采样分析的设置和结果也保存在运行目录中，所有worker共用
+METRICS_STATE_DIR = os.environ.get('METRICS_STATE_DIR', 'cache/metrics')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+# 运行目录以最早导入本模块的进程号和时间命名（gunicorn中为主进程，worker通过fork继承），
+# 上次运行的快照不会混入本次 /metrics；所属进程已退出的运行目录在下次启动时删除
+METRICS_RUN_ID = f"{os.getpid()}-{time.time_ns()}"
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+# 本进程中创建的全部直方图（按名称）和计数器采集函数，由 MetricsAggregator 写入快照
+HISTOGRAMS = {}
+COUNTER_COLLECTORS = []
+
+class Histogram:
+    """线程安全的带标签直方图，按Prometheus文本格式输出。
+
+    观测值记录在各进程内存中，由 MetricsAggregator 定期写成快照，输出时合并所有worker。
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        HISTOGRAMS[name] = self
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {k: {'counts': list(v['counts']), 'sum': v['sum'], 'count': v['count']} for k, v in self._series.items()}
+
+    def render(self, snapshot=None):
+        """snapshot为 {标签元组: 序列}，默认为本进程的数据"""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        if snapshot is None:
+            snapshot = self.snapshot()
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', repr(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', '+Inf')])} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series['count']}")
+        return '\n'.join(lines)
+
+STAGE_SECONDS = Histogram(
+    'estimator_stage_seconds', '各处理阶段耗时（秒），按端点/阶段区分', ('endpoint', 'stage')
+)
+REQUEST_SECONDS = Histogram(
+    'estimator_request_seconds', 'HTTP请求总耗时（秒）', ('endpoint', 'method', 'status')
+)
+
+@contextmanager
+def timer(endpoint, stage):
+    """记录一个阶段的耗时：with timer('predict', 'explain'): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, endpoint, stage)
+
+def render_gauge(name, documentation, value, labels=(), metric_type='gauge'):
+    return render_gauges(name, documentation, [(labels, value)], metric_type)
+
+def render_gauges(name, documentation, samples, metric_type='gauge'):
+    """同一指标的多条带标签样本：samples 为 [(labels, value), ...]"""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {metric_type}']
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels([k for k, _ in labels], [v for _, v in labels])} {value}")
+    return '\n'.join(lines)
+
+def _reset_after_fork():
+    # 主进程在fork前记录的观测值（如eager模式下的启动阶段耗时）由主进程自己的快照计入，子进程清空以免按worker数重复计数
+    for histogram in HISTOGRAMS.values():
+        histogram._lock = threading.Lock()
+        histogram._series = {}
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def register_counters(collect):
+    """登记一个计数器采集函数：collect() 返回本进程的计数器样本 [(名称, 说明, [(标签名, 值), ...], 数值), ...]，
+    /metrics 输出的是所有worker之和"""
+    COUNTER_COLLECTORS.append(collect)
+
+def process_snapshot():
+    """本进程全部直方图和计数器的可JSON序列化快照"""
+    return {
+        'histograms': {
+            name: [[list(labels), series] for labels, series in histogram.snapshot().items()]
+            for name, histogram in HISTOGRAMS.items()
+        },
+        'counters': [[name, documentation, [list(pair) for pair in labels], value]
+                     for collect in COUNTER_COLLECTORS for name, documentation, labels, value in collect()],
+    }
+
+def merge_snapshots(snapshots):
+    """直方图各桶计数、总和、次数以及计数器直接相加，合并结果与单个进程处理全部请求时相同"""
+    histograms = {}
+    counters = {}
+    for snapshot in snapshots:
+        for name, series_list in snapshot['histograms'].items():
+            merged = histograms.setdefault(name, {})
+            for labels, series in series_list:
+                target = merged.setdefault(tuple(labels), {'counts': [0] * len(series['counts']), 'sum': 0.0, 'count': 0})
+                target['counts'] = [a + b for a, b in zip(target['counts'], series['counts'])]
+                target['sum'] += series['sum']
+                target['count'] += series['count']
+        for name, documentation, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            previous = counters.get(key, (documentation, 0))
+            counters[key] = (documentation, previous[1] + value)
+    return {'histograms': histograms, 'counters': counters}
+
+def render_prometheus(extra_sections=(), merged=None):
+    """merged为 merge_snapshots 的结果；默认只输出本进程的数据"""
+    if merged is None:
+        merged = merge_snapshots([process_snapshot()])
+    sections = [histogram.render(merged['histograms'].get(name, {})) for name, histogram in HISTOGRAMS.items()]
+    by_name = {}
+    for (name, labels), (documentation, value) in sorted(merged['counters'].items()):
+        by_name.setdefault(name, (documentation, []))[1].append((labels, value))
+    for name, (documentation, samples) in by_name.items():
+        sections.append(render_gauges(name, documentation, samples, metric_type='counter'))
+    sections.extend(extra_sections)
+    return '\n'.join(sections) + '\n'
+
+def _write_json(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _file_pid(name):
+    """快照文件名和运行目录名都以进程号开头"""
+    try:
+        return int(name.split('-', 1)[0])
+    except ValueError:
+        return None
+
+def run_state_dir(state_dir=METRICS_STATE_DIR):
+    return os.path.join(state_dir, METRICS_RUN_ID)
+
+def prune_metrics_state(state_dir=METRICS_STATE_DIR):
+    """删除所属进程已退出的运行目录（上次运行的快照、采样分析设置与结果）；每次服务启动时调用"""
+    if not os.path.isdir(state_dir):
+        return
+    for name in os.listdir(state_dir):
+        pid = _file_pid(name)
+        if name != METRICS_RUN_ID and pid is not None and not _pid_alive(pid):
+            shutil.rmtree(os.path.join(state_dir, name), ignore_errors=True)
+
+def _to_snapshot(merged):
+    """把 merge_snapshots 的结果转换回 process_snapshot 的格式，以便写入文件后再次合并"""
+    return {
+        'histograms': {
+            name: [[list(labels), series] for labels, series in series_map.items()]
+            for name, series_map in merged['histograms'].items()
+        },
+        'counters': [[name, documentation, [list(pair) for pair in labels], value]
+                     for (name, labels), (documentation, value) in merged['counters'].items()],
+    }
+
+class MetricsAggregator:
+    """跨worker的指标汇总：后台线程定期把本进程的快照写入运行目录的 workers/ 下，
+    collect() 先写出本进程的最新快照，把已退出进程的快照并入 retired.json，再合并所有快照。"""
+
+    def __init__(self, state_dir=METRICS_STATE_DIR, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.run_dir = run_state_dir(state_dir)
+        self.workers_dir = os.path.join(self.run_dir, 'workers')
+        self.retired_path = os.path.join(self.run_dir, 'retired.json')
+        self.flush_seconds = flush_seconds
+        self._path = None
+        self._path_pid = None
+        self._thread = ProcessThread(self._run, 'metrics-flush')
+        prune_metrics_state(state_dir)
+
+    def ensure_started(self):
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"指标快照写入失败: {e}")
+
+    def flush(self):
+        # fork出的worker不能沿用主进程的快照文件
+        if self._path_pid != os.getpid():
+            self._path = os.path.join(self.workers_dir, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+            self._path_pid = os.getpid()
+        _write_json(self._path, process_snapshot())
+
+    def _snapshot_names(self, dead=False):
+        """workers/ 下的快照文件名；dead=True 时只返回所属进程已退出的"""
+        names = [name for name in os.listdir(self.workers_dir) if name.endswith('.json')]
+        if dead:
+            names = [name for name in names if _file_pid(name) is not None and not _pid_alive(_file_pid(name))]
+        return names
+
+    def retire_dead_workers(self):
+        """把已退出进程（如被回收重启的worker）的快照累加进 retired.json 后删除，抓取时不必逐个读取"""
+        if not self._snapshot_names(dead=True):
+            return
+        # 多个worker可能同时抓取，持锁后重新列出文件，同一份快照只会被并入一次
+        with open(os.path.join(self.run_dir, 'retired.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            dead = self._snapshot_names(dead=True)
+            snapshots = [_read_json(os.path.join(self.workers_dir, name)) for name in dead]
+            retired = _read_json(self.retired_path)
+            snapshots = [snapshot for snapshot in snapshots + [retired] if snapshot is not None]
+            _write_json(self.retired_path, _to_snapshot(merge_snapshots(snapshots)))
+            for name in dead:
+                os.remove(os.path.join(self.workers_dir, name))
+
+    def collect(self):
+        self.flush()
+        self.retire_dead_workers()
+        snapshots = [_read_json(os.path.join(self.workers_dir, name)) for name in self._snapshot_names()]
+        snapshots = [snapshot for snapshot in snapshots if snapshot is not None]
+        retired = _read_json(self.retired_path)
+        merged = merge_snapshots(snapshots + ([retired] if retired is not None else []))
+        merged['workers'] = len(snapshots)
+        return merged
+
+class SlowRequestProfiler:
+    """按采样率对请求做cProfile分析，只保留超过慢请求阈值的分析结果。
+
+    同一时刻只分析一个请求（解释器同时只允许一个活动的profiler）。开关、采样率和阈值保存在
+    本次运行目录的 profiling.json 中，任一worker修改后其他worker在 PROFILING_SETTINGS_CHECK_SECONDS 内生效；
+    分析结果也写入该目录，查询时返回所有worker最近的 PROFILING_KEEP 条。
+    """
+
+    def __init__(self, enabled=PROFILING_ENABLED, sample_rate=PROFILING_SAMPLE_RATE, slow_ms=PROFILING_SLOW_MS,
+                 state_dir=METRICS_STATE_DIR):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.settings_path = os.path.join(run_state_dir(state_dir), 'profiling.json')
+        self.profiles_dir = os.path.join(run_state_dir(state_dir), 'profiles')
+        self._settings_mtime = None
+        self._checked_at = 0.0
+        self._active = threading.Lock()
+        self._counter = 0
+
+    def configure(self, enabled=None, sample_rate=None, slow_ms=None):
+        self._apply(enabled, sample_rate, slow_ms)
+        _write_json(self.settings_path, {'enabled': self.enabled, 'sample_rate': self.sample_rate, 'slow_ms': self.slow_ms})
+
+    def _apply(self, enabled=None, sample_rate=None, slow_ms=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        if slow_ms is not None:
+            self.slow_ms = float(slow_ms)
+
+    def _refresh(self):
+        """读取其他worker写入的共享设置；文件未变化时只做一次stat"""
+        try:
+            mtime = os.stat(self.settings_path).st_mtime_ns
+            if mtime == self._settings_mtime:
+                return
+            with open(self.settings_path, encoding='utf-8') as f:
+                settings = json.load(f)
+            self._apply(settings.get('enabled'), settings.get('sample_rate'), settings.get('slow_ms'))
+            self._settings_mtime = mtime
+        except (OSError, ValueError):
+            return
+
+    def start(self):
+        """按采样率决定是否分析本次请求；返回profiler或None"""
+        now = time.monotonic()
+        if now - self._checked_at >= PROFILING_SETTINGS_CHECK_SECONDS:
+            self._checked_at = now
+            self._refresh()
+        if not self.enabled or self.sample_rate <= 0:
+            return None
+        self._counter += 1
+        if self._counter % max(1, round(1 / self.sample_rate)) != 0:
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            self._active.release()
+            return None
+        return profiler
+
+    def stop(self, profiler, endpoint, duration_s):
+        profiler.disable()
+        self._active.release()
+        if duration_s * 1000 < self.slow_ms:
+            return
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+        profile = {
+            'endpoint': endpoint,
+            'duration_ms': duration_s * 1000,
+            'time': time.time(),
+            'pid': os.getpid(),
+            'stats': out.getvalue(),
+        }
+        try:
+            _write_json(os.path.join(self.profiles_dir, f"{time.time_ns()}-{os.getpid()}.json"), profile)
+            # 只保留所有worker合计最近的 PROFILING_KEEP 条
+            for name in self._profile_files()[:-PROFILING_KEEP]:
+                os.remove(os.path.join(self.profiles_dir, name))
+        except OSError as e:
+            print(f"慢请求分析结果写入失败: {e}")
+
+    def _profile_files(self):
+        """按时间排序的分析结果文件名（文件名以纳秒时间戳开头）"""
+        if not os.path.isdir(self.profiles_dir):
+            return []
+        names = [name for name in os.listdir(self.profiles_dir) if name.endswith('.json')]
+        return sorted(names, key=lambda name: int(name.split('-', 1)[0]))
+
+    def status(self):
+        self._refresh()
+        profiles = []
+        for name in self._profile_files()[-PROFILING_KEEP:]:
+            try:
+                with open(os.path.join(self.profiles_dir, name), encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'slow_ms': self.slow_ms,
+            'profiles': profiles,
+        }
@@ -0,0 +1,125 @@
+import os
+import threading
+
+from background import ProcessThread
+from feedback_store import FEEDBACK_DB_PATH, FEEDBACK_TARGET_COL, feedback_source, read_feedback_since
+
+# numpy和scikit-learn在建索引时才导入：服务进程在导入时就要创建 NeighborIndexUpdater，不能拖慢冷启动
+
+# --- 相似项目检索设置 ---
+# /predict?neighbors=k 允许的最大k
+NEIGHBORS_MAX_K = int(os.environ.get('NEIGHBORS_MAX_K', 20))
+# 新反馈先进入增量缓冲区（暴力计算距离），缓冲区达到这么多行时把全部数据重建为新的KD树
+NEIGHBORS_REBUILD_ROWS = int(os.environ.get('NEIGHBORS_REBUILD_ROWS', 256))
+# 后台线程从反馈数据库跟进新反馈的周期；本worker收到反馈时会立即唤醒
+NEIGHBORS_SYNC_SECONDS = float(os.environ.get('NEIGHBORS_SYNC_SECONDS', 10))
+
+class NeighborIndex:
+    """某个模型版本的相似历史项目索引。
+
+    在与模型相同的特征空间中检索：数值特征用流水线中已拟合的StandardScaler标准化，类别特征独热编码
+    （即FeatureEncoder的输出）。训练数据建成KD树，之后的新反馈先放入增量缓冲区，查询时两者各取前k个再合并。
+    索引状态是一个整体替换的元组，查询线程不加锁也不会看到更新到一半的数据。
+    """
+
+    def __init__(self, artifact, encoder):
+        import numpy as np
+        from sklearn.neighbors import KDTree
+
+        self._KDTree = KDTree
+        self.encoder = encoder
+        self.training_cols = list(artifact['training_cols'])
+        data = artifact['training_data']
+        rows = [
+            {'project': source, 'total_cost_cny': float(record[FEEDBACK_TARGET_COL]),
+             'features': {c: record[c] for c in self.training_cols}}
+            for source, record in zip(artifact['training_sources'], data.to_dict('records'))
+        ]
+        X = np.asarray(artifact['background'], dtype=np.float64)
+        # 已被模型学习的反馈条数，增量跟进从这里开始
+        self.feedback_seen = artifact.get('n_feedback_rows', 0)
+        self._lock = threading.Lock()
+        self._state = (KDTree(X), X, rows, np.empty((0, X.shape[1])), [])
+
+    def __len__(self):
+        _, X, _, delta_X, _ = self._state
+        return len(X) + len(delta_X)
+
+    def add(self, records, sources):
+        """加入新的项目记录（含真实造价）；缓冲区满时重建KD树"""
+        import numpy as np
+
+        if not records:
+            return
+        # encode返回的是线程缓冲区，逐行拷贝
+        encoded = np.array([self.encoder.encode(record)[0].copy() for record in records])
+        rows = [
+            {'project': source, 'total_cost_cny': float(record[FEEDBACK_TARGET_COL]),
+             'features': {c: record.get(c) for c in self.training_cols}}
+            for source, record in zip(sources, records)
+        ]
+        with self._lock:
+            tree, X, base_rows, delta_X, delta_rows = self._state
+            delta_X = np.vstack([delta_X, encoded])
+            delta_rows = delta_rows + rows
+            if len(delta_X) >= NEIGHBORS_REBUILD_ROWS:
+                X = np.vstack([X, delta_X])
+                self._state = (self._KDTree(X), X, base_rows + delta_rows, np.empty((0, X.shape[1])), [])
+            else:
+                self._state = (tree, X, base_rows, delta_X, delta_rows)
+
+    def query(self, feature_row, k):
+        """返回与已编码特征行最相近的k个历史项目，按距离从近到远排列。
+
+        缺失的数值特征编码为NaN，KD树不接受NaN：这些维度按0（标准化后的训练均值）计算距离。
+        """
+        import numpy as np
+
+        feature_row = np.nan_to_num(feature_row, nan=0.0)
+        tree, X, base_rows, delta_X, delta_rows = self._state
+        k_tree = min(k, len(X))
+        distances, indices = tree.query(feature_row[None, :], k=k_tree)
+        candidates = [(float(d), base_rows[i]) for d, i in zip(distances[0], indices[0])]
+        if len(delta_X):
+            delta_distances = np.sqrt(((delta_X - feature_row) ** 2).sum(axis=1))
+            for i in np.argsort(delta_distances)[:k]:
+                candidates.append((float(delta_distances[i]), delta_rows[i]))
+            candidates.sort(key=lambda c: c[0])
+        return [{**row, 'distance': distance} for distance, row in candidates[:k]]
+
+class NeighborIndexUpdater:
+    """后台跟进反馈数据库中的新反馈并加入当前模型版本的相似项目索引。
+
+    与后台训练线程相同：gunicorn --preload 时线程不会随fork继承，按进程号在每个worker中各启动一个。
+    """
+
+    def __init__(self, get_index, feedback_path=FEEDBACK_DB_PATH):
+        self.get_index = get_index
+        self.feedback_path = feedback_path
+        self._wakeup = threading.Event()
+        self._thread = ProcessThread(self._run, 'neighbor-index-updater')
+
+    def ensure_started(self):
+        self._thread.start()
+
+    def notify_feedback(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(NEIGHBORS_SYNC_SECONDS)
+            self._wakeup.clear()
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"相似项目索引更新失败: {e}")
+
+    def sync(self):
+        index = self.get_index()
+        if index is None:
+            return
+        records = read_feedback_since(self.feedback_path, index.feedback_seen)
+        if not records:
+            return
+        index.add(records, [feedback_source(index.feedback_seen + i) for i in range(len(records))])
+        index.feedback_seen += len(records)
@@ -0,0 +1,44 @@
+import argparse
+
+from artifacts import MODEL_DIR, load_latest_artifact
+from feedback_store import FEEDBACK_DB_PATH
+
+# --- 一致性检查命令行工具的公共部分 ---
+# explain.py、feature_encoder.py、tree_export.py 各自的快速路径都要与原流水线对比：
+# 加载最新产物、计算对比报告、逐项打印，超出误差上限时以非零状态退出，可直接用于CI
+
+def make_parser(description, with_data=False):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='模型产物目录')
+    if with_data:
+        parser.add_argument('--data-path', default='data', help='初始估算CSV所在目录')
+        parser.add_argument('--feedback-path', default=FEEDBACK_DB_PATH, help='反馈数据库路径')
+    return parser
+
+def require_latest_artifact(model_dir):
+    artifact = load_latest_artifact(model_dir)
+    if artifact is None:
+        raise SystemExit(f"在 '{model_dir}' 中未找到模型产物，请先运行 python training.py")
+    return artifact
+
+def load_training_rows(artifact, args):
+    """按产物的训练列读取当前的全部训练数据（初始数据 + 反馈）"""
+    from ingestion import load_and_process_all_data
+
+    df = load_and_process_all_data(args.data_path, args.feedback_path)
+    return df[artifact['training_cols']]
+
+def check_report(report, tolerances):
+    """逐项打印对比报告；tolerances中的项为误差上限，任一项超出（或为NaN）时以非零状态退出"""
+    failures = []
+    for key, value in report.items():
+        if key not in tolerances:
+            print(f"{key}: {value}")
+            continue
+        passed = value <= tolerances[key]
+        print(f"{key}: {value} (上限 {tolerances[key]}，{'通过' if passed else '未通过'})")
+        if not passed:
+            failures.append(key)
+    if failures:
+        raise SystemExit(f"一致性检查未通过: {', '.join(failures)}")
+    print("一致性检查通过。")
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# --- 预测结果缓存设置 ---
+PREDICT_CACHE_ENABLED = os.environ.get('PREDICT_CACHE_ENABLED', '1') == '1'
+PREDICT_CACHE_SIZE = int(os.environ.get('PREDICT_CACHE_SIZE', 4096))
+PREDICT_CACHE_TTL_SECONDS = float(os.environ.get('PREDICT_CACHE_TTL_SECONDS', 600))
+# 浮点输入在生成缓存键前保留的小数位数；位数越少，“几乎相同”的参数组合越容易命中同一条缓存
+PREDICT_CACHE_FLOAT_DECIMALS = int(os.environ.get('PREDICT_CACHE_FLOAT_DECIMALS', 6))
+# 设置后在本机各gunicorn worker之间共享缓存，建议放在 /dev/shm 下，例如 /dev/shm/predict_cache.sqlite
+PREDICT_CACHE_SHARED_PATH = os.environ.get('PREDICT_CACHE_SHARED_PATH', '')
+
+class SharedCacheStore:
+    """基于本地SQLite文件的跨进程缓存存储，放在tmpfs上时等同于共享内存。
+
+    SQLite连接不能跨fork使用：gunicorn --preload 时缓存在主进程中创建，因此构造时不打开连接，
+    每个进程的每个线程在首次使用时各自打开连接（并在需要时建表）。
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connect(self):
+        # 线程局部变量会随fork复制到子进程，按进程号区分，子进程不会拿到父进程的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS predict_cache ('
+                'key TEXT PRIMARY KEY, version TEXT NOT NULL, value TEXT NOT NULL, created REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS predict_cache_created ON predict_cache (created)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, min_created):
+        row = self._connect().execute(
+            'SELECT value FROM predict_cache WHERE key = ? AND created >= ?', (key, min_created)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, version, value):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO predict_cache (key, version, value, created) VALUES (?, ?, ?, ?)',
+            (key, version, json.dumps(value, ensure_ascii=False), time.time())
+        )
+        # 超出容量时按写入时间淘汰最旧的条目，返回淘汰数量
+        return conn.execute(
+            'DELETE FROM predict_cache WHERE key IN ('
+            'SELECT key FROM predict_cache ORDER BY created DESC LIMIT -1 OFFSET ?)', (self.max_entries,)
+        ).rowcount
+
+    def drop_other_versions(self, version):
+        return self._connect().execute('DELETE FROM predict_cache WHERE version != ?', (version,)).rowcount
+
+class PredictionCache:
+    """/predict 响应的进程内LRU+TTL缓存。
+
+    缓存键由模型版本和按TRAINING_COLS顺序规范化后的输入行组成，浮点值先按配置的小数位数取整。
+    模型版本变化时自动清空旧版本的条目。可选地以共享存储作为二级缓存在worker之间共享结果。
+    """
+
+    def __init__(self, max_entries=PREDICT_CACHE_SIZE, ttl_seconds=PREDICT_CACHE_TTL_SECONDS,
+                 float_decimals=PREDICT_CACHE_FLOAT_DECIMALS, shared_path=PREDICT_CACHE_SHARED_PATH):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.float_decimals = float_decimals
+        self.shared = SharedCacheStore(shared_path, max_entries) if shared_path else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.counters = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def make_key(self, model_version, training_cols, data):
+        values = []
+        for column in training_cols:
+            value = data.get(column)
+            if isinstance(value, float) and self.float_decimals is not None:
+                value = round(value, self.float_decimals)
+            values.append(value)
+        return json.dumps([model_version, values], ensure_ascii=False, separators=(',', ':'))
+
+    def _check_version(self, model_version):
+        # 调用方需持有self._lock
+        if model_version == self._version:
+            return
+        if self._entries:
+            self.counters['invalidations'] += len(self._entries)
+            self._entries.clear()
+        if self.shared is not None:
+            self.counters['invalidations'] += self.shared.drop_other_versions(model_version)
+        self._version = model_version
+
+    def get(self, model_version, key):
+        with self._lock:
+            self._check_version(model_version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if time.monotonic() - created <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return value
+                del self._entries[key]
+                self.counters['expirations'] += 1
+        if self.shared is not None:
+            value = self.shared.get(key, time.time() - self.ttl_seconds)
+            if value is not None:
+                with self._lock:
+                    self.counters['shared_hits'] += 1
+                    self._store(key, value)
+                return value
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, model_version, key, value):
+        with self._lock:
+            self._check_version(model_version)
+            self._store(key, value)
+        if self.shared is not None:
+            evicted = self.shared.put(key, model_version, value)
+            with self._lock:
+                self.counters['evictions'] += evicted
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def counter_samples(self):
+        """本进程的计数器样本，由 metrics.register_counters 登记后在 /metrics 中按所有worker求和"""
+        with self._lock:
+            return [(f'estimator_predict_cache_{name}_total', f'预测缓存{name}计数', [], value)
+                    for name, value in self.counters.items()]
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'size': len(self._entries), 'max_entries': self.max_entries,
+                    'model_version': self._version, 'shared': self.shared is not None}
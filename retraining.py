@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+
+from artifacts import MODEL_DIR, latest_artifact_path, load_artifact, save_artifact, training_lock
+from background import ProcessThread
+from feedback_store import FEEDBACK_DB_PATH, count_feedback
+from metrics import timer
+
+# --- 后台重新训练设置 ---
+RETRAIN_ENABLED = os.environ.get('RETRAIN_ENABLED', '1') == '1'
+# 累计新增多少条反馈后触发重新训练
+RETRAIN_MIN_FEEDBACK_ROWS = int(os.environ.get('RETRAIN_MIN_FEEDBACK_ROWS', 20))
+# 有新反馈时，最长间隔多少秒必须重新训练一次
+RETRAIN_INTERVAL_SECONDS = float(os.environ.get('RETRAIN_INTERVAL_SECONDS', 3600))
+# 后台线程检查反馈数量和新产物的周期
+RETRAIN_POLL_SECONDS = float(os.environ.get('RETRAIN_POLL_SECONDS', 30))
+# 增量训练每次追加的树数量；累计追加的树超过上限后改为从头完整训练。
+# 上限相对于完整训练时的树数量（n_estimators，可能来自离线调参），而不是绝对的总树数
+RETRAIN_WARM_START_ROUNDS = int(os.environ.get('RETRAIN_WARM_START_ROUNDS', 20))
+RETRAIN_MAX_EXTRA_TREES = int(os.environ.get('RETRAIN_MAX_EXTRA_TREES', 200))
+
+def base_tree_count(artifact):
+    """产物最近一次完整训练时的树数量；增量训练沿用基础产物的regressor_params，因此该值不随追加的树变化"""
+    from training import DEFAULT_REGRESSOR_PARAMS
+
+    params = artifact.get('regressor_params') or DEFAULT_REGRESSOR_PARAMS
+    return params.get('n_estimators') or DEFAULT_REGRESSOR_PARAMS['n_estimators']
+
+class RetrainScheduler:
+    """后台重新训练调度器。
+
+    后台线程定期检查反馈数据，满足条件时在请求路径之外训练新模型并保存为新产物，
+    然后通过on_new_artifact回调交给应用原子替换。多个gunicorn worker之间通过
+    模型目录下的文件锁保证同一时间只有一个进程在训练；其他worker发现LATEST指向
+    新产物后直接加载，不重复训练。
+    """
+
+    def __init__(self, get_artifact, on_new_artifact, data_path='data',
+                 feedback_path=FEEDBACK_DB_PATH, model_dir=MODEL_DIR):
+        self.get_artifact = get_artifact
+        self.on_new_artifact = on_new_artifact
+        self.data_path = data_path
+        self.feedback_path = feedback_path
+        self.model_dir = model_dir
+        self._wakeup = threading.Event()
+        self._thread = ProcessThread(self._run, 'retrain-scheduler')
+        self._last_train_time = time.monotonic()
+        self._requested = False
+
+    def ensure_started(self):
+        """在当前进程中启动后台线程（每个worker各一个）"""
+        self._thread.start()
+
+    def notify_feedback(self):
+        """有新反馈写入时唤醒后台线程，尽快检查是否达到触发条件"""
+        self._wakeup.set()
+
+    def request_retrain(self, reason):
+        """外部请求（如输入漂移监控）：有新反馈时不再等待数量或时间条件，尽快重新训练"""
+        print(f"收到重新训练请求: {reason}")
+        self._requested = True
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(RETRAIN_POLL_SECONDS)
+            self._wakeup.clear()
+            try:
+                self.check()
+            except Exception as e:
+                print(f"后台重新训练失败: {e}")
+
+    def check(self):
+        self._load_newer_artifact()
+        current = self.get_artifact()
+        if current is None:
+            return
+        new_rows = count_feedback(self.feedback_path) - current.get('n_feedback_rows', 0)
+        if new_rows <= 0:
+            return
+        interval_elapsed = time.monotonic() - self._last_train_time >= RETRAIN_INTERVAL_SECONDS
+        if new_rows >= RETRAIN_MIN_FEEDBACK_ROWS or interval_elapsed or self._requested:
+            self._requested = False
+            self.retrain(current)
+
+    def _load_newer_artifact(self):
+        """若其他进程（或离线训练命令）已写入更新的产物，直接加载并替换"""
+        path = latest_artifact_path(self.model_dir)
+        current = self.get_artifact()
+        if path is None or not os.path.exists(path):
+            return
+        if current is not None and os.path.basename(path) == f"model-{current['version']}.joblib":
+            return
+        self.on_new_artifact(load_artifact(path))
+
+    def retrain(self, current):
+        with training_lock(self.model_dir, blocking=False) as acquired:
+            if not acquired:
+                # 其他worker正在训练，等它写出新产物后由_load_newer_artifact加载
+                return
+            # 拿到锁后再检查一次，避免刚刚有其他进程完成训练
+            self._load_newer_artifact()
+            current = self.get_artifact()
+            if count_feedback(self.feedback_path) <= current.get('n_feedback_rows', 0):
+                return
+            print(f"后台重新训练开始，当前模型版本: {current['version']}")
+            # 训练相关的重型依赖只在真正需要训练时才导入
+            from ingestion import FEEDBACK_ROWS_ATTR, load_and_process_all_data
+            from training import build_artifact
+            with timer('training', 'load_data'):
+                df = load_and_process_all_data(self.data_path, self.feedback_path)
+            # 以实际读到的反馈条数为准：检查之后、读取之前新写入的反馈也已参与本次训练
+            n_feedback_rows = df.attrs[FEEDBACK_ROWS_ATTR]
+            n_trees = current['model_pipeline'].named_steps['regressor'].get_booster().num_boosted_rounds()
+            if n_trees + RETRAIN_WARM_START_ROUNDS <= base_tree_count(current) + RETRAIN_MAX_EXTRA_TREES:
+                artifact = build_artifact(df, n_feedback_rows, base_artifact=current, extra_rounds=RETRAIN_WARM_START_ROUNDS)
+            else:
+                # 完整重新训练沿用当前产物的参数（包括离线调参得到的参数）
+                artifact = build_artifact(df, n_feedback_rows, regressor_params=current.get('regressor_params'))
+            save_artifact(artifact, self.model_dir)
+            self._last_train_time = time.monotonic()
+        self.on_new_artifact(artifact)
+        print(f"后台重新训练完成，新模型版本: {artifact['version']}")
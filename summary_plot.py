@@ -0,0 +1,88 @@
+import os
+import io
+import threading
+import numpy as np
+import shap
+import matplotlib
+matplotlib.use('Agg') # 使用非GUI后端，防止在服务器上出错
+import matplotlib.pyplot as plt
+
+try:
+    plt.rcParams['font.sans-serif'] = ['SimHei']
+    plt.rcParams['axes.unicode_minus'] = False
+except Exception as e:
+    print(f"无法设置中文字体，图像中的中文可能无法显示: {e}")
+
+# --- 全局特征重要性图缓存设置 ---
+# 图像只依赖全局SHAP值，因此每个模型版本只渲染一次，PNG同时缓存在内存和磁盘上
+SUMMARY_PLOT_CACHE_DIR = os.environ.get('SUMMARY_PLOT_CACHE_DIR', 'cache')
+
+# pyplot使用全局状态，多线程并发绘图并不安全，所有渲染都在这把锁内串行完成
+_render_lock = threading.Lock()
+_cache_lock = threading.Lock()
+# 只保留当前模型版本的结果：version -> PNG字节 / 特征重要性列表
+_png_cache = {}
+_importance_cache = {}
+
+def render_summary_png(shap_values, feature_names):
+    with _render_lock:
+        fig, ax = plt.subplots(figsize=(10, 8))
+        try:
+            shap.summary_plot(shap_values, plot_type="bar", show=False, feature_names=feature_names)
+            plt.title('全局特征重要性')
+            plt.tight_layout()
+            buf = io.BytesIO()
+            fig.savefig(buf, format='png', bbox_inches='tight')
+        finally:
+            plt.close(fig)
+    return buf.getvalue()
+
+def get_summary_png(version, shap_values, feature_names):
+    """按模型版本获取PNG：内存 -> 磁盘 -> 渲染，渲染结果写回两级缓存"""
+    png = _png_cache.get(version)
+    if png is not None:
+        return png
+    with _cache_lock:
+        # 拿到锁后再查一次，并发的首个请求之间只渲染一次
+        png = _png_cache.get(version)
+        if png is not None:
+            return png
+        path = os.path.join(SUMMARY_PLOT_CACHE_DIR, f"shap_summary-{version}.png")
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                png = f.read()
+        else:
+            png = render_summary_png(shap_values, feature_names)
+            try:
+                os.makedirs(SUMMARY_PLOT_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(png)
+                os.replace(tmp_path, path)
+                _remove_other_versions(version)
+            except OSError as e:
+                print(f"无法写入全局特征重要性图缓存: {e}")
+        _png_cache.clear()
+        _png_cache[version] = png
+    return png
+
+def _remove_other_versions(version):
+    # 磁盘上同样只保留当前模型版本的PNG，否则每次重新训练都会留下一个文件
+    keep = f"shap_summary-{version}.png"
+    for name in os.listdir(SUMMARY_PLOT_CACHE_DIR):
+        if name.startswith('shap_summary-') and name.endswith('.png') and name != keep:
+            try:
+                os.remove(os.path.join(SUMMARY_PLOT_CACHE_DIR, name))
+            except FileNotFoundError:
+                pass
+
+def get_feature_importance(version, shap_values, feature_names):
+    """各特征的平均|SHAP|，按重要性从高到低排列，供前端自行绘图"""
+    importance = _importance_cache.get(version)
+    if importance is None:
+        mean_abs = np.abs(np.asarray(shap_values.values)).mean(axis=0)
+        order = np.argsort(mean_abs)[::-1]
+        importance = [{'feature': feature_names[i], 'mean_abs_shap': float(mean_abs[i])} for i in order]
+        _importance_cache.clear()
+        _importance_cache[version] = importance
+    return importance
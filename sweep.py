@@ -0,0 +1,70 @@
+import os
+import math
+import numpy as np
+
+# --- 敏感性分析（参数扫描）设置 ---
+# 单次扫描的网格点数上限（两个特征时为两者取值数之积）
+PREDICT_SWEEP_MAX_POINTS = int(os.environ.get('PREDICT_SWEEP_MAX_POINTS', 10000))
+PREDICT_SWEEP_MAX_FEATURES = 2
+
+def parse_axis(spec, training_cols, categorical_cols):
+    """校验一个扫描维度，返回 (特征名, 取值数, 生成取值列表的函数)。
+
+    数值特征: {"feature": "pavement_cost_index", "start": 0.9, "stop": 1.3, "num": 41} 或 {"feature": ..., "values": [...]}
+    类别特征: {"feature": "highway_grade", "values": ["一级", "二级"]}
+    start/stop/num 形式的取值在网格点数通过上限检查后才生成，过大的num不会先分配内存。
+    """
+    if not isinstance(spec, dict) or 'feature' not in spec:
+        raise ValueError('扫描维度必须是包含feature字段的JSON对象。')
+    feature = spec['feature']
+    if feature not in training_cols:
+        raise ValueError(f'未知的特征列: {feature}')
+    if 'values' in spec:
+        values = spec['values']
+        if not isinstance(values, list) or not values:
+            raise ValueError(f'特征 {feature} 的values必须是非空数组。')
+        if feature in categorical_cols:
+            return feature, len(values), lambda: values
+        return feature, len(values), lambda: [float(v) for v in values]
+    if feature in categorical_cols:
+        raise ValueError(f'类别特征 {feature} 需要用values列出取值。')
+    try:
+        start, stop, num = float(spec['start']), float(spec['stop']), int(spec.get('num', 21))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f'数值特征 {feature} 需要start、stop和num（或values）。')
+    if num < 2:
+        raise ValueError(f'特征 {feature} 的num至少为2。')
+    return feature, num, lambda: np.linspace(start, stop, num).tolist()
+
+def parse_sweep(request_data, training_cols, categorical_cols):
+    """校验扫描请求，返回 (基准项目字典, [(特征名, 取值列表), ...])"""
+    if not isinstance(request_data, dict) or not isinstance(request_data.get('base'), dict):
+        raise ValueError('请求体必须包含base（基准项目）对象。')
+    specs = request_data.get('sweep')
+    if isinstance(specs, dict):
+        specs = [specs]
+    if not isinstance(specs, list) or not 1 <= len(specs) <= PREDICT_SWEEP_MAX_FEATURES:
+        raise ValueError(f'sweep必须包含1到{PREDICT_SWEEP_MAX_FEATURES}个扫描维度。')
+    parsed = [parse_axis(spec, training_cols, categorical_cols) for spec in specs]
+    if len(parsed) == 2 and parsed[0][0] == parsed[1][0]:
+        raise ValueError('两个扫描维度不能是同一个特征。')
+    # 先按各维度的取值数检查网格点数（Python整数相乘，不会溢出），通过后再生成取值
+    n_points = math.prod(n for _, n, _ in parsed)
+    if n_points > PREDICT_SWEEP_MAX_POINTS:
+        raise ValueError(f'网格点数 {n_points} 超过上限 {PREDICT_SWEEP_MAX_POINTS}。')
+    axes = [(feature, make_values()) for feature, _, make_values in parsed]
+    return request_data['base'], axes
+
+def build_grid(encoder, base, axes):
+    """基准项目只编码一次，再把各扫描维度编码后的取值写入对应列，得到形状为 (网格点数, 特征数) 的矩阵。
+
+    两个维度时按第一个维度为行、第二个维度为列的顺序展开，结果可直接reshape为二维曲面。
+    """
+    base_row, _ = encoder.encode(base)
+    shape = [len(values) for _, values in axes]
+    grid = np.repeat(base_row[None, :], int(np.prod(shape)), axis=0)
+    positions = np.indices(shape).reshape(len(shape), -1)
+    for (feature, values), position in zip(axes, positions):
+        index, block = encoder.encode_values(feature, values)
+        grid[:, index] = block[position]
+    return grid, shape
@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 测试直接导入仓库根目录下的模块；所有缓存、状态和产物都写到临时目录，不碰仓库内的 cache/ 与 models/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORKDIR = tempfile.mkdtemp(prefix='estimator-tests-')
+os.environ.update({
+    'MODEL_DIR': os.path.join(WORKDIR, 'models'),
+    'FEEDBACK_DB_PATH': os.path.join(WORKDIR, 'feedback.db'),
+    'INGEST_CACHE_PATH': os.path.join(WORKDIR, 'cache', 'ingest_cache.json'),
+    'SUMMARY_PLOT_CACHE_DIR': os.path.join(WORKDIR, 'cache'),
+    'DRIFT_STATE_DIR': os.path.join(WORKDIR, 'cache', 'drift'),
+    'METRICS_STATE_DIR': os.path.join(WORKDIR, 'cache', 'metrics'),
+    'MODEL_WARMUP': 'background',
+    'RETRAIN_ENABLED': '0',
+    'PREDICT_CACHE_ENABLED': '0',
+})
+
+@pytest.fixture(scope='session')
+def data_path():
+    """benchmark 生成的合成概算CSV目录"""
+    from benchmark import generate_estimate_csvs
+
+    path = os.path.join(WORKDIR, 'data')
+    generate_estimate_csvs(path, 60)
+    return path
+
+@pytest.fixture(scope='session')
+def training_df(data_path):
+    """由合成概算CSV经正常的导入流程得到的训练数据"""
+    from ingestion import load_and_process_all_data
+
+    return load_and_process_all_data(data_path, os.environ['FEEDBACK_DB_PATH'])
+
+@pytest.fixture(scope='session')
+def artifact(training_df):
+    from artifacts import save_artifact
+    from ingestion import FEEDBACK_ROWS_ATTR
+    from training import build_artifact
+
+    artifact = build_artifact(training_df, training_df.attrs[FEEDBACK_ROWS_ATTR])
+    save_artifact(artifact, os.environ['MODEL_DIR'])
+    return artifact
+
+@pytest.fixture(scope='session')
+def client(artifact):
+    import app
+
+    app.swap_model(artifact)
+    return app.app.test_client()
+
+@pytest.fixture
+def project_row(artifact):
+    """训练数据中的第一个项目，格式与 /predict 请求体相同"""
+    record = artifact['training_data'].iloc[0]
+    return {c: (record[c].item() if hasattr(record[c], 'item') else record[c]) for c in artifact['training_cols']}
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import explain
+from explain import SHAP_ADDITIVITY_RTOL, SHAP_PATH_DEPENDENT_RTOL, build_explainer, compare_explainers
+
+def test_contributions_sum_to_prediction_and_match_path_dependent_shap(artifact):
+    background = artifact['background']
+
+    report = compare_explainers(artifact['model_pipeline'], background, background.iloc[:50], repeat=1)
+
+    assert report['tree_additivity_max_rel_error'] <= SHAP_ADDITIVITY_RTOL
+    assert report['background_additivity_max_rel_error'] <= SHAP_ADDITIVITY_RTOL
+    assert report['tree_vs_shap_path_dependent_max_rel_error'] <= SHAP_PATH_DEPENDENT_RTOL
+
+@pytest.mark.parametrize('mode', ['tree', 'background'])
+def test_explainer_accepts_encoded_float32_rows(artifact, mode):
+    model_pipeline = artifact['model_pipeline']
+    X = np.asarray(model_pipeline.named_steps['preprocessor'].transform(artifact['training_data'].iloc[:5]), dtype=np.float32)
+
+    values = build_explainer(model_pipeline, artifact['background'], mode)(X)
+
+    prediction = model_pipeline.named_steps['regressor'].predict(X)
+    assert values.values.shape == X.shape
+    np.testing.assert_allclose(values.values.sum(axis=1) + values.base_values, prediction,
+                               rtol=0, atol=SHAP_ADDITIVITY_RTOL * np.abs(prediction).max())
+
+def test_predict_response_contributions_sum_to_estimate(client, project_row):
+    body = client.post('/predict', json=project_row).get_json()
+
+    assert sum(body['shap_values']) + body['base_value'] == pytest.approx(body['estimated_cost'][0], rel=SHAP_ADDITIVITY_RTOL)
+
+def test_cli_passes_on_trained_artifact(artifact, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['explain.py', '--model-dir', os.environ['MODEL_DIR'], '--rows', '20'])
+
+    explain.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import numpy as np
+
+import feature_encoder
+from feature_encoder import ENCODER_FEATURE_ATOL, ENCODER_PREDICTION_RTOL, compare_with_pipeline
+
+def edge_rows(artifact, project_row):
+    """训练行之外再加上缺失数值特征、null值和未知类别的请求"""
+    encoder = artifact['feature_encoder']
+    numeric = encoder.numeric_cols[0]
+    categorical = encoder.categorical[0][0]
+    return [
+        project_row,
+        {k: v for k, v in project_row.items() if k != numeric},
+        {**project_row, numeric: None},
+        {**project_row, categorical: '未知类别'},
+    ]
+
+def test_encoder_matches_pipeline(artifact, project_row):
+    rows = artifact['training_data'][artifact['training_cols']].to_dict('records') + edge_rows(artifact, project_row)
+
+    report = compare_with_pipeline(artifact['model_pipeline'], artifact['feature_encoder'], rows, repeat=1)
+
+    assert report['max_feature_abs_diff'] <= ENCODER_FEATURE_ATOL
+    assert report['max_prediction_rel_diff'] <= ENCODER_PREDICTION_RTOL
+
+def test_missing_category_encodes_like_unknown_category(artifact, project_row):
+    encoder = artifact['feature_encoder']
+    column = encoder.categorical[0][0]
+
+    missing = encoder.encode({k: v for k, v in project_row.items() if k != column})[0].copy()
+    unknown = encoder.encode({**project_row, column: '未知类别'})[0]
+
+    np.testing.assert_array_equal(missing, unknown)
+
+def test_encode_values_matches_encode(artifact, project_row):
+    encoder = artifact['feature_encoder']
+    for column in [encoder.numeric_cols[0], encoder.categorical[0][0]]:
+        values = [project_row[column], None] if column in encoder.numeric_cols else [project_row[column], '未知类别']
+        index, block = encoder.encode_values(column, values)
+        for value, encoded in zip(values, block):
+            row, _ = encoder.encode({**project_row, column: value})
+            np.testing.assert_array_equal(row[index], encoded)
+
+def test_misplaced_missing_value_fails_the_check(artifact, project_row):
+    encoder = artifact['feature_encoder']
+    column = encoder.numeric_cols[0]
+
+    class ShiftedEncoder:
+        training_cols = encoder.training_cols
+
+        def encode(self, data):
+            return encoder.encode({**data, column: None})
+
+    report = compare_with_pipeline(artifact['model_pipeline'], ShiftedEncoder(), [project_row], repeat=1)
+
+    assert not report['max_feature_abs_diff'] <= ENCODER_FEATURE_ATOL
+
+def test_cli_passes_on_trained_artifact(artifact, data_path, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', [
+        'feature_encoder.py', '--model-dir', os.environ['MODEL_DIR'], '--data-path', data_path, '--repeat', '1',
+    ])
+
+    feature_encoder.main()
@@ -0,0 +1,35 @@
+import pandas as pd
+
+from ingestion import COST_CATEGORIES, LineItemClassifier
+
+def first_rows(classifier, names):
+    return dict(classifier.first_rows(pd.DataFrame({'项目名称': names}))[['category', 'row']].itertuples(index=False))
+
+def test_nested_keywords_match_like_str_contains():
+    classifier = LineItemClassifier({'tunnel': '隧道', 'long_tunnel': '特长隧道'})
+
+    assert first_rows(classifier, ['特长隧道', '隧道']) == {'tunnel': 0, 'long_tunnel': 0}
+    assert first_rows(classifier, ['隧道', '特长隧道']) == {'tunnel': 0, 'long_tunnel': 1}
+
+def test_first_rows_equal_per_category_str_contains():
+    names = pd.Series([
+        '公路公里', '第一部分 建筑安装工程费', '路基工程', '特殊路基处理', '路面工程', None, '桥梁涵洞工程',
+        '交通工程及沿线设施', '第二部分 土地使用及拆迁补偿费', '第一至四部分合计', '公路基本造价', '路基工程（续）',
+    ])
+    expected = {}
+    for key, term in COST_CATEGORIES.items():
+        matches = names[names.str.contains(term, na=False, regex=False)]
+        if len(matches):
+            expected[key] = int(matches.index[0])
+
+    assert first_rows(LineItemClassifier(), names) == expected
+
+def test_first_rows_by_group_returns_positions_within_concatenated_frame():
+    frames = [pd.DataFrame({'项目名称': ['路基工程', 'x', '路面工程']}), pd.DataFrame({'项目名称': ['路面工程', '路基工程']})]
+    combined = pd.concat([df.assign(file=i) for i, df in enumerate(frames)])
+
+    result = LineItemClassifier().first_rows(combined, by='file')
+
+    assert sorted(result.itertuples(index=False, name=None)) == [
+        (0, 'pavement_cost', 2), (0, 'subgrade_cost', 0), (1, 'pavement_cost', 3), (1, 'subgrade_cost', 4),
+    ]
@@ -0,0 +1,25 @@
+import numpy as np
+
+from neighbors import NeighborIndex
+
+def test_query_treats_missing_numeric_feature_as_training_mean(artifact, project_row):
+    index = NeighborIndex(artifact, artifact['feature_encoder'])
+    column = artifact['feature_encoder'].numeric_cols[0]
+    row, _ = artifact['feature_encoder'].encode({**project_row, column: None})
+    assert np.isnan(row).any()
+
+    neighbors = index.query(row, 3)
+
+    filled = np.nan_to_num(row, nan=0.0)
+    assert [n['distance'] for n in neighbors] == sorted(n['distance'] for n in neighbors)
+    assert neighbors == index.query(filled, 3)
+
+def test_predict_with_neighbors_accepts_missing_numeric_field(client, project_row):
+    data = {k: v for k, v in project_row.items() if k != 'route_length_km'}
+
+    response = client.post('/predict?neighbors=3', json=data)
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert len(body['estimated_cost']) == 1
+    assert len(body['neighbors']) == 3
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+
+import tree_export
+from tree_export import TREES_RTOL, TreeEnsemble, export_trees, verify_trees
+
+def encoded_rows(artifact):
+    model_pipeline = artifact['model_pipeline']
+    X = model_pipeline.named_steps['preprocessor'].transform(artifact['training_data'][artifact['training_cols']])
+    return np.asarray(X, dtype=np.float32)
+
+def test_exported_trees_match_booster(artifact, tmp_path):
+    X = encoded_rows(artifact)
+    # 每列各有一部分缺失值，覆盖各节点的默认方向
+    X_missing = X.copy()
+    X_missing[np.arange(len(X)) % 3 == 0, ::2] = np.nan
+
+    ensemble = TreeEnsemble(export_trees(artifact['model_pipeline'], str(tmp_path / 'model.trees'), X))
+
+    assert verify_trees(artifact['model_pipeline'], ensemble, X)['max_rel_error'] <= TREES_RTOL
+    assert verify_trees(artifact['model_pipeline'], ensemble, X_missing)['max_rel_error'] <= TREES_RTOL
+    assert ensemble.predict(X[0]).shape == (1,)
+
+def test_cli_passes_on_trained_artifact(artifact, data_path, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', [
+        'tree_export.py', '--model-dir', os.environ['MODEL_DIR'], '--data-path', data_path, '--repeat', '1',
+    ])
+
+    tree_export.main()
+
+    assert os.path.exists(tree_export.trees_path(os.environ['MODEL_DIR'], artifact['version']))
@@ -0,0 +1,154 @@
+import os
+import json
+import argparse
+import hashlib
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from xgboost import XGBRegressor
+
+from artifacts import MODEL_DIR, save_artifact
+from explain import build_explainer
+from feature_encoder import FeatureEncoder
+from feedback_store import FEEDBACK_DB_PATH
+from ingestion import FEEDBACK_ROWS_ATTR, PROJECT_SOURCE_ATTR, load_and_process_all_data
+from metrics import timer
+
+# --- 模型训练逻辑 ---
+CATEGORICAL_FEATURES = ['highway_grade', 'project_type']
+# 未经调参时使用的XGBoost参数；调参结果（见 tuning.py）随产物保存并在之后的完整重新训练中沿用
+DEFAULT_REGRESSOR_PARAMS = {'objective': 'reg:squarederror', 'n_estimators': 100, 'random_state': 42}
+
+def make_preprocessor(X):
+    """数值列标准化、类别列独热编码；返回未拟合的ColumnTransformer及数值列列表"""
+    numeric_features = X.select_dtypes(include=np.number).columns.tolist()
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), numeric_features),
+            ('cat', OneHotEncoder(handle_unknown='ignore'), CATEGORICAL_FEATURES)
+        ], remainder='passthrough')
+    return preprocessor, numeric_features
+
+def get_feature_names(preprocessor, numeric_features):
+    try:
+        ohe_feature_names = preprocessor.named_transformers_['cat'].get_feature_names_out(CATEGORICAL_FEATURES)
+        return numeric_features + ohe_feature_names.tolist()
+    except: # 兼容旧版sklearn
+        ohe_feature_names = preprocessor.named_transformers_['cat'].get_feature_names(CATEGORICAL_FEATURES)
+        return numeric_features + list(ohe_feature_names)
+
+def train_model(df, regressor_params=None):
+    X = df.drop('total_cost_cny', axis=1)
+    y = df['total_cost_cny']
+    preprocessor, numeric_features = make_preprocessor(X)
+    model_pipeline = Pipeline(steps=[
+        ('preprocessor', preprocessor),
+        ('regressor', XGBRegressor(**(regressor_params or DEFAULT_REGRESSOR_PARAMS)))
+    ])
+    model_pipeline.fit(X, y)
+    all_feature_names = get_feature_names(model_pipeline.named_steps['preprocessor'], numeric_features)
+    print("模型训练完成。")
+    return model_pipeline, X.columns.tolist(), all_feature_names
+
+def make_model_version(df):
+    """版本号 = UTC时间戳 + 训练数据内容哈希，便于追溯每个产物由哪批数据训练得到"""
+    data_hash = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()[:8]
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{data_hash}"
+
+def continue_training(base_artifact, df, extra_rounds):
+    """在已有booster基础上继续追加extra_rounds棵树，而不是从头训练全部树。
+
+    沿用已拟合的preprocessor，使新增的树与原有的树看到同一套特征编码。
+    """
+    base_pipeline = base_artifact['model_pipeline']
+    preprocessor = base_pipeline.named_steps['preprocessor']
+    base_regressor = base_pipeline.named_steps['regressor']
+    X = df[base_artifact['training_cols']]
+    y = df['total_cost_cny']
+    regressor = XGBRegressor(**{**base_regressor.get_params(), 'n_estimators': extra_rounds})
+    regressor.fit(preprocessor.transform(X), y, xgb_model=base_regressor.get_booster())
+    model_pipeline = Pipeline(steps=[('preprocessor', preprocessor), ('regressor', regressor)])
+    print(f"模型增量训练完成，新增{extra_rounds}棵树。")
+    return model_pipeline, base_artifact['training_cols'], base_artifact['all_feature_names']
+
+def build_artifact(df, n_feedback_rows=0, base_artifact=None, extra_rounds=0, regressor_params=None, cv_report=None):
+    """训练模型并计算解释器背景数据与全局SHAP值，打包为可持久化的产物。
+
+    提供base_artifact和extra_rounds时从已有模型继续训练，否则按regressor_params从头训练；
+    cv_report为调参得到的交叉验证报告，随产物一起保存。
+    """
+    if base_artifact is not None and extra_rounds > 0:
+        with timer('training', 'continue_training'):
+            model_pipeline, training_cols, all_feature_names = continue_training(base_artifact, df, extra_rounds)
+    else:
+        with timer('training', 'train_model'):
+            model_pipeline, training_cols, all_feature_names = train_model(df, regressor_params)
+    background = pd.DataFrame(
+        model_pipeline.named_steps['preprocessor'].transform(df.drop('total_cost_cny', axis=1)),
+        columns=all_feature_names
+    )
+    with timer('training', 'shap_global'):
+        explainer = build_explainer(model_pipeline, background)
+        shap_values_global = explainer(background)
+    return {
+        'version': make_model_version(df),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'n_rows': len(df),
+        'n_feedback_rows': n_feedback_rows,
+        'model_pipeline': model_pipeline,
+        'training_cols': training_cols,
+        'all_feature_names': all_feature_names,
+        'background': background,
+        'shap_values_global': shap_values_global,
+        'feature_encoder': FeatureEncoder.from_pipeline(model_pipeline, training_cols),
+        # 完整重新训练时沿用的参数：增量训练继承基础产物的参数，否则为本次训练使用的参数
+        'regressor_params': (base_artifact.get('regressor_params') if base_artifact is not None and extra_rounds > 0
+                             else regressor_params) or DEFAULT_REGRESSOR_PARAMS,
+        'cv_report': cv_report if cv_report is not None else (base_artifact or {}).get('cv_report'),
+        # 相似项目检索用：原始特征与真实造价，以及每行的来源标注
+        'training_data': df[training_cols + ['total_cost_cny']].reset_index(drop=True),
+        'training_sources': list(df.attrs.get(PROJECT_SOURCE_ATTR) or [f"训练样本#{i + 1}" for i in range(len(df))]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='离线训练估算模型并写入带版本号的模型产物')
+    parser.add_argument('--data-path', default='data', help='初始估算CSV所在目录')
+    parser.add_argument('--feedback-path', default=FEEDBACK_DB_PATH, help='反馈数据库路径')
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='模型产物输出目录')
+    parser.add_argument('--tune', action='store_true', help='先用K折交叉验证搜索XGBoost参数，再用最佳参数训练')
+    parser.add_argument('--param-grid', help='搜索空间JSON文件，格式为 {参数名: [候选值, ...]}，默认见 tuning.DEFAULT_PARAM_GRID')
+    parser.add_argument('--candidates', type=int, help='抽取的候选参数组数')
+    parser.add_argument('--folds', type=int, help='交叉验证折数')
+    parser.add_argument('--workers', type=int, help='并行评估候选参数的进程数')
+    args = parser.parse_args()
+
+    processed_df = load_and_process_all_data(args.data_path, args.feedback_path)
+    n_feedback_rows = processed_df.attrs[FEEDBACK_ROWS_ATTR]
+    regressor_params, cv_report = None, None
+    if args.tune:
+        import tuning
+
+        param_grid = None
+        if args.param_grid:
+            with open(args.param_grid, encoding='utf-8') as f:
+                param_grid = json.load(f)
+        regressor_params, cv_report = tuning.tune(
+            processed_df, param_grid,
+            n_candidates=args.candidates or tuning.TUNING_CANDIDATES,
+            n_folds=args.folds or tuning.TUNING_FOLDS,
+            workers=args.workers or tuning.TUNING_WORKERS,
+        )
+    artifact = build_artifact(processed_df, n_feedback_rows, regressor_params=regressor_params, cv_report=cv_report)
+    save_artifact(artifact, args.model_dir)
+    if cv_report is not None:
+        report_path = os.path.join(args.model_dir, f"cv-report-{artifact['version']}.json")
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(cv_report, f, ensure_ascii=False, indent=2)
+        print(f"交叉验证报告已保存: {report_path}")
+    print(f"训练完成，模型版本: {artifact['version']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import numpy as np
+
+# --- 树数组导出与验证工具 ---
+# 把booster展开为np.memmap可直接映射的树数组文件，并以纯NumPy评估器验证其与booster的预测一致。
+# 服务进程不使用它：SHAP解释、特征编码和相似项目检索都依赖完整的joblib流水线和booster，
+# 换用树数组评估器既不减少各worker的加载耗时和内存，预测本身也不比inplace_predict快（耗时见 python tree_export.py）
+
+# 文件格式：8字节魔数 + 8字节小端头部长度 + JSON头部（各数组的dtype/形状/偏移） + 按64字节对齐的数组数据
+TREES_MAGIC = b'XGBTREE1'
+TREES_ALIGN = 64
+# 导出后与booster逐行对比预测值，最大相对误差超过此值时拒绝导出
+TREES_RTOL = 1e-5
+
+def trees_path(model_dir, version):
+    return os.path.join(model_dir, f"model-{version}.trees")
+
+def flatten_booster(booster):
+    """把booster的JSON模型展开为连续数组：所有树的节点依次拼接，子节点下标为全局下标，叶子节点的左右子节点为-1"""
+    model = json.loads(booster.save_raw('json'))
+    learner = model['learner']
+    objective = learner['objective']['name']
+    if objective != 'reg:squarederror' or learner['gradient_booster']['name'] != 'gbtree':
+        raise ValueError(f"树数组导出只支持 gbtree + reg:squarederror，当前为: {learner['gradient_booster']['name']} + {objective}")
+    trees = learner['gradient_booster']['model']['trees']
+    feature, threshold, left, right, value, default_left, roots = [], [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for tree in trees:
+        if any(tree['split_type']):
+            raise ValueError('树数组导出不支持类别特征分裂。')
+        lc = np.asarray(tree['left_children'], dtype=np.int32)
+        rc = np.asarray(tree['right_children'], dtype=np.int32)
+        is_leaf = lc == -1
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        roots.append(offset)
+        # 叶子节点的分裂特征置0，遍历时可以安全地取值，不影响结果
+        feature.append(np.where(is_leaf, 0, tree['split_indices']).astype(np.int32))
+        threshold.append(np.where(is_leaf, np.float32(0), conditions))
+        value.append(np.where(is_leaf, conditions, np.float32(0)))
+        left.append(np.where(is_leaf, -1, lc + offset).astype(np.int32))
+        right.append(np.where(is_leaf, -1, rc + offset).astype(np.int32))
+        default_left.append(np.asarray(tree['default_left'], dtype=np.uint8))
+        max_depth = max(max_depth, _tree_depth(lc, rc))
+        offset += len(lc)
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    arrays = {
+        'feature': np.concatenate(feature),
+        'threshold': np.concatenate(threshold).astype(np.float32),
+        'left': np.concatenate(left),
+        'right': np.concatenate(right),
+        'value': np.concatenate(value).astype(np.float32),
+        'default_left': np.concatenate(default_left),
+        'roots': np.asarray(roots, dtype=np.int32),
+    }
+    meta = {
+        'base_score': base_score,
+        'max_depth': max_depth,
+        'n_trees': len(trees),
+        'n_features': int(learner['learner_model_param']['num_feature']),
+    }
+    return arrays, meta
+
+def _tree_depth(left, right):
+    depth = 0
+    level = [0]
+    while level:
+        level = [child for node in level for child in (left[node], right[node]) if child != -1]
+        if level:
+            depth += 1
+    return depth
+
+def write_trees(path, arrays, meta):
+    """写入树数组文件"""
+    specs = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // TREES_ALIGN) * TREES_ALIGN
+        specs[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    header = json.dumps({'meta': meta, 'arrays': specs}).encode('utf-8')
+    # 数据区从头部之后的下一个对齐位置开始，各数组偏移相对于数据区起点
+    data_start = -(-(16 + len(header)) // TREES_ALIGN) * TREES_ALIGN
+    with open(path, 'wb') as f:
+        f.write(TREES_MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + specs[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+    return path
+
+class TreeEnsemble:
+    """从树数组文件映射出的纯NumPy集成树评估器。
+
+    数组通过np.memmap只读映射，同一文件在多个worker之间共享操作系统页缓存；
+    predict对一批行同时遍历所有树：每一步把 (行, 树) 上的当前节点整体推进一层，
+    共推进max_depth步。比较规则与XGBoost一致：float32特征值 < 阈值走左子树，缺失值走默认方向。
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(8) != TREES_MAGIC:
+                raise ValueError(f"不是树数组文件: {path}")
+            header_len = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        data_start = -(-(16 + header_len) // TREES_ALIGN) * TREES_ALIGN
+        self.path = path
+        self._mmap = np.memmap(path, dtype=np.uint8, mode='r')
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            start = data_start + spec['offset']
+            view = self._mmap[start:start + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+            setattr(self, name, view)
+        meta = header['meta']
+        self.base_score = meta['base_score']
+        self.max_depth = meta['max_depth']
+        self.n_trees = meta['n_trees']
+        self.n_features = meta['n_features']
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            values = X[rows, self.feature[node]]
+            go_left = np.where(np.isnan(values), self.default_left[node] == 1, values < self.threshold[node])
+            child = np.where(go_left, self.left[node], self.right[node])
+            # 已到达叶子的位置保持不动
+            node = np.where(child == -1, node, child)
+        return (self.value[node].sum(axis=1, dtype=np.float64) + self.base_score).astype(np.float32)
+
+def export_trees(model_pipeline, path, check_X=None):
+    """原子地导出流水线中booster的树数组文件；提供check_X（已预处理的特征矩阵）时先与booster逐行对比再落盘"""
+    booster = model_pipeline.named_steps['regressor'].get_booster()
+    arrays, meta = flatten_booster(booster)
+    # 临时文件名带进程号：多个worker可能同时为同一个旧产物导出
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write_trees(tmp_path, arrays, meta)
+    if check_X is not None:
+        report = verify_trees(model_pipeline, TreeEnsemble(tmp_path), check_X)
+        if report['max_rel_error'] > TREES_RTOL:
+            os.remove(tmp_path)
+            raise ValueError(f"树数组评估结果与模型不一致: {report}")
+    os.replace(tmp_path, path)
+    return path
+
+def verify_trees(model_pipeline, ensemble, X):
+    """对比树数组评估器与XGBoost的预测值，返回最大绝对误差和相对误差"""
+    expected = model_pipeline.named_steps['regressor'].predict(np.asarray(X, dtype=np.float32))
+    actual = ensemble.predict(X)
+    abs_error = float(np.abs(actual.astype(np.float64) - expected).max()) if len(expected) else 0.0
+    scale = float(np.abs(expected).max()) if len(expected) else 1.0
+    return {'rows': len(expected), 'max_abs_error': abs_error, 'max_rel_error': abs_error / (scale or 1.0)}
+
+def main():
+    from parity import check_report, load_training_rows, make_parser, require_latest_artifact
+
+    parser = make_parser('导出树数组文件，并验证其与 model_pipeline.predict 的结果一致', with_data=True)
+    parser.add_argument('--repeat', type=int, default=200, help='耗时测量的重复次数')
+    args = parser.parse_args()
+
+    artifact = require_latest_artifact(args.model_dir)
+    model_pipeline = artifact['model_pipeline']
+    path = export_trees(model_pipeline, trees_path(args.model_dir, artifact['version']))
+    ensemble = TreeEnsemble(path)
+    print(f"树数组文件: {path} ({os.path.getsize(path)}字节, {ensemble.n_trees}棵树, 最大深度{ensemble.max_depth})")
+    X_raw = load_training_rows(artifact, args)
+    expected = model_pipeline.predict(X_raw)
+    X = np.asarray(model_pipeline.named_steps['preprocessor'].transform(X_raw), dtype=np.float32)
+    actual = ensemble.predict(X)
+    max_abs_error = float(np.abs(actual.astype(np.float64) - expected).max())
+    report = {
+        'rows': len(X),
+        'max_abs_error': max_abs_error,
+        'max_rel_error': max_abs_error / (float(np.abs(expected).max()) or 1.0),
+    }
+
+    booster = model_pipeline.named_steps['regressor'].get_booster()
+    for label, batch in (('single_row', X[:1]), ('batch', X)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            booster.inplace_predict(batch)
+        xgboost_ms = (time.perf_counter() - start) / args.repeat * 1000
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            ensemble.predict(batch)
+        numpy_ms = (time.perf_counter() - start) / args.repeat * 1000
+        report[f"{label}_xgboost_ms"] = xgboost_ms
+        report[f"{label}_numpy_ms"] = numpy_ms
+    check_report(report, {'max_rel_error': TREES_RTOL})
+
+if __name__ == '__main__':
+    main()
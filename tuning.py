@@ -0,0 +1,161 @@
+import os
+import time
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+from sklearn.model_selection import KFold
+from xgboost import XGBRegressor
+
+from metrics import timer
+
+# --- 超参数搜索设置 ---
+TUNING_FOLDS = int(os.environ.get('TUNING_FOLDS', 5))
+# 从搜索空间的全组合中无放回随机抽取的候选参数组数
+TUNING_CANDIDATES = int(os.environ.get('TUNING_CANDIDATES', 20))
+# 并行评估候选参数的进程数；每个进程分到 CPU核数 / 进程数 个XGBoost线程，避免线程数超过核数
+TUNING_WORKERS = int(os.environ.get('TUNING_WORKERS', os.cpu_count() or 1))
+# 每折最多训练的树数量，提前停止集上的误差连续TUNING_EARLY_STOPPING_ROUNDS轮不下降即提前停止
+TUNING_MAX_ROUNDS = int(os.environ.get('TUNING_MAX_ROUNDS', 1000))
+TUNING_EARLY_STOPPING_ROUNDS = int(os.environ.get('TUNING_EARLY_STOPPING_ROUNDS', 30))
+# 提前停止集从每折的训练部分中划出（占比），验证部分只用于评分：若在验证部分上选择最佳轮数，
+# 报告的交叉验证成绩会偏乐观，与不提前停止的默认配置对比也不公平
+TUNING_EARLY_STOPPING_FRACTION = float(os.environ.get('TUNING_EARLY_STOPPING_FRACTION', 0.2))
+TUNING_SEED = 42
+
+DEFAULT_PARAM_GRID = {
+    'max_depth': [3, 4, 6, 8],
+    'learning_rate': [0.03, 0.1, 0.3],
+    'min_child_weight': [1, 3, 5],
+    'subsample': [0.7, 0.85, 1.0],
+    'colsample_bytree': [0.7, 0.85, 1.0],
+    'reg_lambda': [1.0, 5.0],
+}
+# 所有候选共用的固定参数：直方图算法建树
+BASE_PARAMS = {'objective': 'reg:squarederror', 'tree_method': 'hist', 'random_state': TUNING_SEED}
+
+def sample_candidates(param_grid, n_candidates, seed=TUNING_SEED):
+    names = sorted(param_grid)
+    combos = list(itertools.product(*(param_grid[name] for name in names)))
+    rng = np.random.default_rng(seed)
+    chosen = rng.choice(len(combos), size=min(n_candidates, len(combos)), replace=False)
+    return [dict(zip(names, (v.item() if hasattr(v, 'item') else v for v in combos[i]))) for i in sorted(chosen)]
+
+def make_folds(df, n_folds=TUNING_FOLDS, seed=TUNING_SEED, early_stopping_fraction=TUNING_EARLY_STOPPING_FRACTION):
+    """K折划分并预处理：每折只在训练部分上拟合一次ColumnTransformer，所有候选参数共用同一批矩阵。
+
+    训练部分再随机划分为拟合集（X_fit）和提前停止集（X_stop）；不提前停止时使用完整的训练部分（X_train）。
+    """
+    from training import make_preprocessor
+
+    X = df.drop('total_cost_cny', axis=1)
+    y = df['total_cost_cny'].to_numpy(dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    folds = []
+    for train_idx, valid_idx in KFold(n_splits=min(n_folds, len(df)), shuffle=True, random_state=seed).split(X):
+        preprocessor, _ = make_preprocessor(X)
+        X_train = np.asarray(preprocessor.fit_transform(X.iloc[train_idx]), dtype=np.float32)
+        X_valid = preprocessor.transform(X.iloc[valid_idx])
+        order = rng.permutation(len(train_idx))
+        n_stop = min(max(1, round(len(train_idx) * early_stopping_fraction)), len(train_idx) - 1)
+        fit_pos, stop_pos = order[n_stop:], order[:n_stop]
+        folds.append({
+            'X_train': X_train, 'y_train': y[train_idx],
+            'X_fit': X_train[fit_pos], 'y_fit': y[train_idx][fit_pos],
+            'X_stop': X_train[stop_pos], 'y_stop': y[train_idx][stop_pos],
+            'X_valid': np.asarray(X_valid, dtype=np.float32), 'y_valid': y[valid_idx],
+        })
+    return folds
+
+def evaluate_candidate(params, folds, n_threads, max_rounds=TUNING_MAX_ROUNDS,
+                       early_stopping_rounds=TUNING_EARLY_STOPPING_ROUNDS):
+    """在各折上训练并验证一组参数；early_stopping_rounds为None时在完整训练部分上固定训练max_rounds棵树。
+
+    最佳轮数在提前停止集上选择，成绩只在未参与训练和选择的验证部分上计算。
+    """
+    start = time.perf_counter()
+    rmse, mae, best_rounds = [], [], []
+    for fold in folds:
+        regressor = XGBRegressor(
+            **BASE_PARAMS, **params, n_estimators=max_rounds, n_jobs=n_threads,
+            early_stopping_rounds=early_stopping_rounds, eval_metric='rmse'
+        )
+        if early_stopping_rounds:
+            regressor.fit(fold['X_fit'], fold['y_fit'], eval_set=[(fold['X_stop'], fold['y_stop'])], verbose=False)
+        else:
+            regressor.fit(fold['X_train'], fold['y_train'], verbose=False)
+        # 启用提前停止时，predict只使用提前停止集误差最低时的前best_iteration+1棵树
+        residual = regressor.predict(fold['X_valid']) - fold['y_valid']
+        rmse.append(float(np.sqrt(np.mean(residual ** 2))))
+        mae.append(float(np.mean(np.abs(residual))))
+        best_rounds.append(regressor.best_iteration + 1 if early_stopping_rounds else max_rounds)
+    return {
+        'params': params,
+        'rmse_mean': float(np.mean(rmse)),
+        'rmse_std': float(np.std(rmse)),
+        'mae_mean': float(np.mean(mae)),
+        'fold_rmse': rmse,
+        'best_rounds': best_rounds,
+        # 最终模型在全部数据上训练，树的数量取各折最佳轮数的平均值
+        'n_estimators': int(round(np.mean(best_rounds))),
+        'fit_seconds': time.perf_counter() - start,
+    }
+
+# 进程池中每个worker只接收一次折数据（通过initializer），之后每个任务只传递参数字典
+_worker_folds = None
+_worker_threads = 1
+
+def _init_worker(folds, n_threads):
+    global _worker_folds, _worker_threads
+    _worker_folds = folds
+    _worker_threads = n_threads
+
+def _evaluate_task(args):
+    params, max_rounds, early_stopping_rounds = args
+    return evaluate_candidate(params, _worker_folds, _worker_threads, max_rounds, early_stopping_rounds)
+
+def tune(df, param_grid=None, n_candidates=TUNING_CANDIDATES, n_folds=TUNING_FOLDS, workers=TUNING_WORKERS,
+         max_rounds=TUNING_MAX_ROUNDS, early_stopping_rounds=TUNING_EARLY_STOPPING_ROUNDS):
+    """K折交叉验证搜索XGBoost参数，返回(最佳参数, 交叉验证报告)；最佳参数可直接传给build_artifact"""
+    start = time.perf_counter()
+    candidates = sample_candidates(param_grid or DEFAULT_PARAM_GRID, n_candidates)
+    with timer('training', 'tuning_folds'):
+        folds = make_folds(df, n_folds)
+    workers = max(1, min(workers, len(candidates)))
+    n_threads = max(1, (os.cpu_count() or 1) // workers)
+    tasks = [(params, max_rounds, early_stopping_rounds) for params in candidates]
+    print(f"开始参数搜索：{len(candidates)}组候选参数，{len(folds)}折交叉验证，{workers}个进程，每进程{n_threads}个线程。")
+    with timer('training', 'tuning_search'):
+        if workers > 1:
+            # 使用spawn而非fork：调用方可能是带有后台线程的服务进程
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(folds, n_threads)) as pool:
+                results = list(pool.map(_evaluate_task, tasks))
+        else:
+            results = [evaluate_candidate(params, folds, n_threads, max_rounds, early_stopping_rounds)
+                       for params, max_rounds, early_stopping_rounds in tasks]
+    results.sort(key=lambda r: r['rmse_mean'])
+    best = results[0]
+    # 以未调参的默认配置（100棵树、不提前停止）在同一批折上的成绩作为对照
+    baseline = evaluate_candidate({}, folds, os.cpu_count() or 1, max_rounds=100, early_stopping_rounds=None)
+    best_params = {**BASE_PARAMS, **best['params'], 'n_estimators': best['n_estimators']}
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'n_rows': len(df),
+        'n_folds': len(folds),
+        'n_candidates': len(candidates),
+        'workers': workers,
+        'threads_per_worker': n_threads,
+        'max_rounds': max_rounds,
+        'early_stopping_rounds': early_stopping_rounds,
+        'early_stopping_fraction': TUNING_EARLY_STOPPING_FRACTION,
+        'elapsed_seconds': time.perf_counter() - start,
+        'best_params': best_params,
+        'best': best,
+        'baseline': baseline,
+        'candidates': results,
+    }
+    print(f"参数搜索完成，用时{report['elapsed_seconds']:.1f}秒。最佳RMSE: {best['rmse_mean']:.4g}"
+          f"（默认参数: {baseline['rmse_mean']:.4g}），最佳参数: {best_params}")
+    return best_params, report